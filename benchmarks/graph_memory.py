@@ -0,0 +1,91 @@
+"""
+Measures the memory used by the compilation graph and cache of a synthetic project.
+
+usage: python benchmarks/graph_memory.py [--sources 1000] [--headers 200] [--includes 8]
+"""
+from argparse import ArgumentParser
+from os import makedirs, path
+from random import Random
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from tracemalloc import start, stop, take_snapshot
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from schr.cache.compilation_cache import CompilationCache
+from schr.compilation.compilation_graph import CompilationGraph
+from schr.utils.cpp import CppUtils
+from schr.utils.logger import Logger, LoggerOptions
+
+def generate_project(working_dir : str, sources : int, headers : int, includes : int) -> None :
+  random = Random(0)
+  for h in range(headers):
+    makedirs(path.join(working_dir, f"include/m{h % 16}"), exist_ok=True)
+    with open(path.join(working_dir, f"include/m{h % 16}/h{h}.hpp"), "w") as fd:
+      if h >= 16:
+        fd.write(f'#include "h{h - 16}.hpp"\n')
+      fd.write(f"#pragma once\nint h{h}();\n")
+  for s in range(sources):
+    makedirs(path.join(working_dir, f"src/m{s % 16}"), exist_ok=True)
+    with open(path.join(working_dir, f"src/m{s % 16}/s{s}.cpp"), "w") as fd:
+      for h in random.sample(range(headers), min(includes, headers)):
+        fd.write(f'#include "../../include/m{h % 16}/h{h}.hpp"\n')
+      fd.write(f"int s{s}() {{ return 0; }}\n")
+
+def main():
+  argsParser = ArgumentParser(description="schr compilation graph memory benchmark")
+  argsParser.add_argument("--sources", type=int, default=1000)
+  argsParser.add_argument("--headers", type=int, default=200)
+  argsParser.add_argument("--includes", type=int, default=8)
+  args = argsParser.parse_args()
+
+  with TemporaryDirectory(prefix="schr-bench-") as working_dir:
+    generate_project(working_dir, args.sources, args.headers, args.includes)
+    options = {
+      "WORKING_DIR": working_dir,
+      "CXX": "g++",
+      "CFLAGS": "-w",
+      "LDFLAGS": "",
+      "OBJ_DIR": path.join(working_dir, "bin"),
+      "CXX_FILE_EXTS": [".cpp", ".cc", ".c"],
+      "HXX_FILE_EXTS": [".hpp", ".h"],
+      "TARGET": "bench",
+      "TARGET_ARGS": "",
+      "TARGETS": [],
+      "TARGETS_FILE": "",
+      "MODE": "C",
+      "DEBUG": False,
+      "DAEMON": False,
+      "COMPDB_IMPORT": "",
+      "COMPDB_EXPORT": "",
+      "JOBS": 1,
+      "WORKERS": [],
+      "MEMORY_BUDGET": 0,
+      "PARTIAL_LINK": False
+    }
+    logger = Logger(LoggerOptions.DefaultWithName("bench"))
+    logger.options["WARN_COLOR"] = "BLACK"
+
+    start()
+    before = take_snapshot()
+    started_at = perf_counter()
+    cpp = CppUtils(options)
+    compilation_graph = CompilationGraph(options, cpp, logger, None)
+    compilation_cache = CompilationCache(compilation_graph, path.join(working_dir, ".schr.cache"), cpp.get_build_configuration_key())
+    elapsed = perf_counter() - started_at
+    after = take_snapshot()
+    stop()
+
+    nodes = compilation_graph.get_all_nodes()
+    edges = sum(len(node.includes) for node in nodes)
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    print(f"nodes: {len(nodes)}")
+    print(f"edges: {edges}")
+    print(f"graph and cache memory: {allocated / 1024:.1f} KiB ({allocated / max(len(nodes), 1):.0f} B/node)")
+    print(f"build time: {elapsed:.2f}s")
+    del compilation_cache
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+"""
+Builds a project with a C++20 module, removes the BMI of the module and checks that a new compilation graph rebuilds it at startup.
+Exits with 1 when the module interface is not rebuilt.
+
+usage: python benchmarks/module_bmi_rebuild.py [--cxx g++]
+"""
+from argparse import ArgumentParser
+from os import chdir, makedirs, path, remove
+from sys import exit, path as sys_path
+from tempfile import TemporaryDirectory
+from time import sleep
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from schr.compilation.compilation_graph import CompilationGraph
+from schr.utils.cpp import CppUtils
+from schr.utils.logger import Logger, LoggerOptions
+
+def generate_project(working_dir : str) -> None :
+  makedirs(path.join(working_dir, "src"), exist_ok=True)
+  with open(path.join(working_dir, "src/m.cppm"), "w") as fd:
+    fd.write("export module m;\nexport int f() { return 42; }\n")
+  with open(path.join(working_dir, "src/main.cpp"), "w") as fd:
+    fd.write("import m;\nint main() { return f() == 42 ? 0 : 1; }\n")
+
+def build(options : dict, logger : Logger) -> CppUtils :
+  cpp = CppUtils(options)
+  compilation_graph = CompilationGraph(options, cpp, logger, None)
+  compilation_graph.build(False) or compilation_graph.link()
+  sleep(0.1)
+  while compilation_graph.is_building():
+    sleep(0.1)
+  return cpp
+
+def main():
+  argsParser = ArgumentParser(description="schr module BMI rebuild check")
+  argsParser.add_argument("--cxx", default="g++")
+  args = argsParser.parse_args()
+
+  logger = Logger(LoggerOptions.DefaultWithName("bench"))
+
+  with TemporaryDirectory(prefix="schr-bench-") as working_dir:
+    generate_project(working_dir)
+    # Object and BMI paths are relative to the project, as when schr runs from it
+    chdir(working_dir)
+    options = {
+      "WORKING_DIR": working_dir,
+      "CXX": args.cxx,
+      "CFLAGS": "-std=c++20",
+      # Compile commands also receive LDFLAGS, an empty value would be passed as an empty argument
+      "LDFLAGS": "-lm",
+      "OBJ_DIR": "obj",
+      "CXX_FILE_EXTS": [".cpp", ".cppm"],
+      "HXX_FILE_EXTS": [".hpp"],
+      "TARGET": "app",
+      "TARGET_ARGS": "",
+      "TARGETS": [],
+      "TARGETS_FILE": "",
+      "MODE": "C",
+      "DEBUG": False,
+      "DAEMON": False,
+      "COMPDB_IMPORT": "",
+      "COMPDB_EXPORT": "",
+      "JOBS": 2,
+      "WORKERS": [],
+      "MEMORY_BUDGET": 0,
+      "PARTIAL_LINK": False
+    }
+    module_interface = path.join(working_dir, "src/m.cppm")
+
+    cpp = build(options, logger)
+    bmi_file_path = path.abspath(cpp.get_module_interface_file_path(module_interface, "m"))
+    if not path.exists(bmi_file_path):
+      logger.error(f"first build did not produce {bmi_file_path}")
+      exit(1)
+
+    remove(bmi_file_path)
+    build(options, logger)
+    if not path.exists(bmi_file_path):
+      logger.error(f"{bmi_file_path} was not rebuilt at startup")
+      exit(1)
+    logger.success(f"{path.relpath(bmi_file_path, working_dir)} rebuilt at startup")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,80 @@
+"""
+Compares a full link of a synthetic project with the relink of a single partial link group followed by the final link of the groups.
+
+usage: python benchmarks/partial_link.py [--dirs 32] [--sources 64] [--functions 50]
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count, makedirs, path
+from subprocess import run
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from schr.compilation.partial_linker import PartialLinker
+from schr.utils.cpp import CppUtils
+from schr.utils.logger import Logger, LoggerOptions
+
+def generate_project(working_dir : str, dirs : int, sources : int, functions : int) -> None :
+  for d in range(dirs):
+    makedirs(path.join(working_dir, f"src/m{d}"), exist_ok=True)
+    for s in range(sources):
+      with open(path.join(working_dir, f"src/m{d}/s{s}.cpp"), "w") as fd:
+        fd.write("".join(f"int f{d}_{s}_{f}(int x) {{ return x * {f} + {s}; }}\n" for f in range(functions)))
+  with open(path.join(working_dir, "src/main.cpp"), "w") as fd:
+    fd.write("int main() { return 0; }\n")
+
+def main():
+  argsParser = ArgumentParser(description="schr partial link benchmark")
+  argsParser.add_argument("--dirs", type=int, default=32)
+  argsParser.add_argument("--sources", type=int, default=64)
+  argsParser.add_argument("--functions", type=int, default=50)
+  argsParser.add_argument("--cxx", default="g++")
+  args = argsParser.parse_args()
+
+  logger = Logger(LoggerOptions.DefaultWithName("bench"))
+
+  with TemporaryDirectory() as working_dir:
+    generate_project(working_dir, args.dirs, args.sources, args.functions)
+    options = {
+      "WORKING_DIR": working_dir,
+      "CXX": args.cxx,
+      "CFLAGS": "-O0 -g",
+      "LDFLAGS": "",
+      "OBJ_DIR": "obj",
+      "CXX_FILE_EXTS": [".cpp"],
+      "HXX_FILE_EXTS": [".hpp"],
+      "COMPDB_IMPORT": ""
+    }
+    cpp = CppUtils(options)
+    sources = cpp.get_cpp_source_file()
+    object_file_paths = [path.join(working_dir, cpp.get_object_file_path(source)) for source in sources]
+
+    started_at = perf_counter()
+    def compile(source : str) -> None :
+      object_file_path = path.join(working_dir, cpp.get_object_file_path(source))
+      makedirs(path.dirname(object_file_path), exist_ok=True)
+      run([args.cxx, "-O0", "-g", "-c", source, "-o", object_file_path], check=True)
+    with ThreadPoolExecutor(max_workers=cpu_count() or 1) as executor:
+      list(executor.map(compile, sources))
+    logger.info(f"{len(sources)} sources compiled in {perf_counter() - started_at:.2f}s")
+
+    target = path.join(working_dir, "app")
+    started_at = perf_counter()
+    run([args.cxx, "-o", target, *object_file_paths], check=True)
+    logger.info(f"full link of {len(object_file_paths)} objects: {perf_counter() - started_at:.3f}s")
+
+    partial_linker = PartialLinker(cpp, logger, cpu_count() or 1)
+    link_inputs = partial_linker.link_groups("app", object_file_paths, print)
+
+    # A one file edit
+    compile(sources[0])
+    started_at = perf_counter()
+    link_inputs = partial_linker.link_groups("app", object_file_paths, print)
+    run([args.cxx, "-o", target, *link_inputs], check=True)
+    logger.success(f"group relink and final link of {len(link_inputs)} inputs: {perf_counter() - started_at:.3f}s")
+
+if __name__ == "__main__":
+  main()
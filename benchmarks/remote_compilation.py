@@ -0,0 +1,150 @@
+"""
+Builds a synthetic project with a compilation graph whose scheduler sends compilations to schr-workers listening on 127.0.0.1,
+then runs the linked program to check the object files sent back.
+Besides two working workers, one worker rejects every compilation and another one is unreachable, so that their jobs fall back to the local slot.
+Exits with 1 when the build, the fallback or the program fails.
+
+usage: python benchmarks/remote_compilation.py [--sources 32] [--slots 2]
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from os import chdir, environ, makedirs, path
+from secrets import token_hex
+from socket import socket
+from subprocess import run, PIPE
+from sys import exit, path as sys_path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from schr.compilation.compilation_graph import CompilationGraph
+from schr.distributed.compile_client import CompileClient
+from schr.distributed.compile_worker import CompileWorker
+from schr.distributed.protocol import WORKER_TOKEN_ENV_VAR
+from schr.utils.cpp import CppUtils
+from schr.utils.logger import Logger, LoggerOptions
+
+class CountingLogger(Logger):
+  """
+  Counts the messages logged by the workers and the scheduler
+  """
+
+  def __init__(self, options : LoggerOptions):
+    super().__init__(options)
+    self.counts = Counter()
+
+  def info(self, log : str) -> None:
+    if log.endswith(" compiled"):
+      self.counts["compiled"] += 1
+    super().info(log)
+
+  def warn(self, log : str) -> None:
+    if " rejected " in log:
+      self.counts["rejected"] += 1
+    super().warn(log)
+
+def generate_project(working_dir : str, sources : int) -> None :
+  makedirs(path.join(working_dir, "include"), exist_ok=True)
+  makedirs(path.join(working_dir, "src"), exist_ok=True)
+  with open(path.join(working_dir, "include/functions.hpp"), "w") as fd:
+    fd.write("#pragma once\n" + "".join(f"int f{s}(int x);\n" for s in range(sources)))
+  for s in range(sources):
+    with open(path.join(working_dir, f"src/f{s}.cpp"), "w") as fd:
+      fd.write(f'#include "functions.hpp"\nint f{s}(int x) {{ return x + {s}; }}\n')
+  with open(path.join(working_dir, "src/main.cpp"), "w") as fd:
+    fd.write('#include <cstdio>\n#include "functions.hpp"\nint main() {\n  int total = 0;\n' + "".join(f"  total += f{s}(1);\n" for s in range(sources)) + '  std::printf("%d\\n", total);\n}\n')
+
+def get_unused_port() -> int :
+  with socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+def main():
+  argsParser = ArgumentParser(description="schr remote compilation check")
+  argsParser.add_argument("--sources", type=int, default=32)
+  argsParser.add_argument("--slots", type=int, default=2)
+  argsParser.add_argument("--cxx", default="g++")
+  args = argsParser.parse_args()
+
+  logger = CountingLogger(LoggerOptions.DefaultWithName("bench"))
+  token = token_hex(16)
+  environ[WORKER_TOKEN_ENV_VAR] = token
+
+  workers = [CompileWorker("127.0.0.1", 0, token, args.slots) for _ in range(2)]
+  # Allows no compiler at all, each compilation it takes is rejected and requeued as local
+  rejecting_worker = CompileWorker("127.0.0.1", 0, token, args.slots, [])
+  for worker in [*workers, rejecting_worker]:
+    worker.logger = CountingLogger(worker.logger.options)
+    Thread(target=worker.serve_forever, daemon=True).start()
+
+  try:
+    CompileClient(workers[0].get_address(), "not the token").get_slots()
+    logger.error("a request without the token was accepted")
+    exit(1)
+  except ConnectionError:
+    pass
+
+  with TemporaryDirectory(prefix="schr-bench-") as working_dir:
+    generate_project(working_dir, args.sources)
+    # Object paths are relative to the project, as when schr runs from it
+    chdir(working_dir)
+    options = {
+      "WORKING_DIR": working_dir,
+      "CXX": args.cxx,
+      "CFLAGS": "-O1 -I include",
+      # Compile commands also receive LDFLAGS, an empty value would be passed as an empty argument
+      "LDFLAGS": "-lm",
+      "OBJ_DIR": "obj",
+      "CXX_FILE_EXTS": [".cpp"],
+      "HXX_FILE_EXTS": [".hpp"],
+      "TARGET": "app",
+      "TARGET_ARGS": "",
+      "TARGETS": [],
+      "TARGETS_FILE": "",
+      "MODE": "C",
+      "DEBUG": False,
+      "DAEMON": False,
+      "COMPDB_IMPORT": "",
+      "COMPDB_EXPORT": "",
+      "JOBS": 1,
+      "WORKERS": [*(worker.get_address() for worker in workers), rejecting_worker.get_address(), f"127.0.0.1:{get_unused_port()}"],
+      "MEMORY_BUDGET": 0,
+      "PARTIAL_LINK": False
+    }
+
+    started_at = perf_counter()
+    compilation_graph = CompilationGraph(options, CppUtils(options), logger, None)
+    compilation_graph.build(False) or compilation_graph.link()
+    sleep(0.1)
+    while compilation_graph.is_building():
+      sleep(0.1)
+
+    remote_compilations = sum(worker.logger.counts["compiled"] for worker in workers)
+    logger.info(f"{args.sources + 1} sources built in {perf_counter() - started_at:.2f}s, {remote_compilations} by the workers, {logger.counts['rejected']} rejected and compiled locally")
+
+    failed_nodes = [node.key for node in compilation_graph.get_all_non_header_nodes() if node.has_compilation_error]
+    if len(failed_nodes):
+      logger.error(f"compilation errors: {', '.join(failed_nodes)}")
+      exit(1)
+    if remote_compilations == 0:
+      logger.error("no compilation was sent to the workers")
+      exit(1)
+    if logger.counts["rejected"] == 0:
+      logger.error("the rejecting worker did not get any compilation, the local fallback was not exercised")
+      exit(1)
+
+    output = run([path.join(working_dir, "app")], stdout=PIPE, text=True, check=True).stdout.strip()
+    expected = sum(1 + s for s in range(args.sources))
+    if output != str(expected):
+      logger.error(f"program printed {output}, expected {expected}")
+      exit(1)
+    logger.success(f"program built through the workers printed {output}")
+
+  for worker in [*workers, rejecting_worker]:
+    worker.shutdown()
+    worker.server_close()
+
+if __name__ == "__main__":
+  main()
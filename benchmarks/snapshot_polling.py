@@ -0,0 +1,97 @@
+"""
+Compares the time of an idle poll of schr's snapshot observer with a watchdog polling snapshot, and checks that a change is detected.
+The tree also holds a build tree without sources, which the observer seeded with the sources (as schr does) never polls,
+the observer is then checked to still see a file created in a new directory.
+
+usage: python benchmarks/snapshot_polling.py [--dirs 2000] [--files 10] [--other-files 10] [--build-dirs 2000]
+"""
+from argparse import ArgumentParser
+from os import makedirs, path
+from sys import exit, path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List, Union
+
+from watchdog.utils.dirsnapshot import DirectorySnapshot
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from schr.utils.logger import Logger, LoggerOptions
+from schr.watching.snapshot_observer import SnapshotObserver
+
+def generate_tree(working_dir : str, dirs : int, files : int, other_files : int, build_dirs : int) -> None :
+  for d in range(dirs):
+    dir_path = path.join(working_dir, f"m{d % 32}", f"d{d}")
+    makedirs(dir_path, exist_ok=True)
+    for f in range(files):
+      with open(path.join(dir_path, f"s{f}.cpp"), "w") as fd:
+        fd.write(f"int s{d}_{f}() {{ return 0; }}\n")
+    for f in range(other_files):
+      with open(path.join(dir_path, f"data{f}.txt"), "w") as fd:
+        fd.write("data\n")
+  for d in range(build_dirs):
+    dir_path = path.join(working_dir, "build", f"b{d % 32}", f"d{d}")
+    makedirs(dir_path, exist_ok=True)
+    for f in range(other_files):
+      with open(path.join(dir_path, f"o{f}.o"), "w") as fd:
+        fd.write("data\n")
+
+def start_observer(working_dir : str, logger : Logger, seed_paths : Union[List[str], None]) -> SnapshotObserver :
+  observer = SnapshotObserver(lambda p: p.endswith(".cpp"), [], logger, seed_paths)
+  observer.schedule(None, working_dir)
+  if seed_paths is None:
+    observer._scan_trees([observer._root], {})
+  else:
+    observer._scan_seed_directories()
+  observer._racy_directories.clear()
+  observer._racy_files.clear()
+  return observer
+
+def time_idle_polls(observer : SnapshotObserver, polls : int) -> float :
+  started_at = perf_counter()
+  for _ in range(polls):
+    observer.poll()
+  return (perf_counter() - started_at) / polls * 1000
+
+def main():
+  argsParser = ArgumentParser(description="schr snapshot polling benchmark")
+  argsParser.add_argument("--dirs", type=int, default=2000)
+  argsParser.add_argument("--files", type=int, default=10)
+  argsParser.add_argument("--other-files", type=int, default=10)
+  argsParser.add_argument("--build-dirs", type=int, default=2000)
+  argsParser.add_argument("--polls", type=int, default=5)
+  args = argsParser.parse_args()
+
+  logger = Logger(LoggerOptions.DefaultWithName("bench"))
+
+  with TemporaryDirectory() as working_dir:
+    generate_tree(working_dir, args.dirs, args.files, args.other_files, args.build_dirs)
+
+    started_at = perf_counter()
+    for _ in range(args.polls):
+      DirectorySnapshot(working_dir, recursive=True)
+    logger.info(f"watchdog snapshot: {(perf_counter() - started_at) / args.polls * 1000:.1f}ms per poll")
+
+    full_observer = start_observer(working_dir, logger, None)
+    logger.info(f"schr snapshot of the whole tree: {time_idle_polls(full_observer, args.polls):.1f}ms per idle poll of {len(full_observer._directories)} directories")
+
+    sources = [path.join(working_dir, f"m{d % 32}", f"d{d}", f"s{f}.cpp") for d in range(args.dirs) for f in range(args.files)]
+    observer = start_observer(working_dir, logger, sources)
+    logger.info(f"schr snapshot seeded with the sources: {time_idle_polls(observer, args.polls):.1f}ms per idle poll of {len(observer._directories)} directories")
+    if len(observer._files) != len(full_observer._files):
+      logger.error(f"the seeded snapshot holds {len(observer._files)} files, expected {len(full_observer._files)}")
+      exit(1)
+
+    with open(path.join(working_dir, "m0", "d0", "s0.cpp"), "a") as fd:
+      fd.write("// changed\n")
+    makedirs(path.join(working_dir, "m0", "new"))
+    with open(path.join(working_dir, "m0", "new", "n.cpp"), "w") as fd:
+      fd.write("int n() { return 0; }\n")
+    events = observer.poll()
+    logger.success(f"after a change: {', '.join(f'{e.event_type} {path.relpath(e.src_path, working_dir)}' for e in events)}")
+    if not any(e.event_type == "created" and e.src_path.endswith("n.cpp") for e in events):
+      logger.error("the file created in a new directory was not detected")
+      exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -11,6 +11,7 @@ setup(
     entry_points={
         'console_scripts': [
             'schr=cli:main',
+            'schr-worker=cli:worker_main',
         ],
     },
 )
@@ -1,11 +1,22 @@
 from argparse import ArgumentParser, Action, Namespace, RawTextHelpFormatter
-from os import getcwd
+from json import dumps
+from os import chdir, getcwd, cpu_count, sep, path
+from tempfile import mkdtemp
 from sys import argv
-from typing import List
+from typing import List, Union
 
 from schr.hot_reloader import HotReloader
+from schr.analysis.rebuild_cost_analyzer import RebuildCostAnalyzer
+from schr.compilation.build_files import as_ninja, as_static_makefile
+from schr.compilation.compilation_graph import CompilationGraph
+from schr.distributed.compile_worker import CompileWorker
+from schr.distributed.protocol import WORKER_TOKEN_ENV_VAR, get_worker_token
+from schr.daemon.daemon_client import DaemonClient
+from schr.replay.event_replayer import EventReplayer
 from schr.utils.cmd import is_valid_command
-from schr.options import SimpleCppHotReloaderOptions, as_makefile
+from schr.utils.cpp import CppUtils
+from schr.utils.logger import Logger, LoggerOptions
+from schr.options import SimpleCppHotReloaderOptions, as_makefile, load_targets_file
 
 class EqualAssignedArgument(Action):
 
@@ -49,7 +60,7 @@ class AlphabeticalCharactersCombinationArgument(Action):
 
 class ModeCharactersCombination (AlphabeticalCharactersCombinationArgument):
 
-  ALLOWED_CHARACTER = "CR"
+  ALLOWED_CHARACTER = "CRT"
   CASE_SENSITIVE = False
   DEDUPLICATE = True
   UPPER_DEFAULT = True
@@ -57,17 +68,40 @@ class ModeCharactersCombination (AlphabeticalCharactersCombinationArgument):
 
 
 def main():
-  argsParser = ArgumentParser(usage="schr", description="Simple CPP Hot Reloader (schr)", formatter_class=RawTextHelpFormatter)
+  if len(argv) > 1 and argv[1] == "client":
+    return client_main(argv[2:])
+  if len(argv) > 1 and argv[1] == "replay":
+    return replay_main(argv[2:])
+  # schr analyze takes the same project arguments as schr
+  is_analyze = len(argv) > 1 and argv[1] == "analyze"
+
+  argsParser = ArgumentParser(usage="schr analyze" if is_analyze else "schr", description="Simple CPP Hot Reloader (schr)", formatter_class=RawTextHelpFormatter)
   argsParser.add_argument("-c", "--compiler", help="C/C++ compiler executable to use (eg gcc, g++, clang, ...)?\ndefaults to g++", required=False)
   argsParser.add_argument("-cf", "--cflags", action=EqualAssignedArgument, metavar='="CFLAGS ..."', help='Sets additional flags for the C/C++ compiler (eg -std=c++20, -Wall, ...).\nMust be used with direct affectation and quoted strings (eg -cf="-std=c++20 ...")', required=False)
   argsParser.add_argument("-lf", "--lflags", action=EqualAssignedArgument, metavar='="LFLAGS ..."', help='Sets additional flags for the C/C++ linker (eg -lpthread, -lvulkan, ...).\nMust be used with direct affectation and quoted strings (eg -lf="-lpthread ...")', required=False)
   argsParser.add_argument("-od", "--obj-dir", help="Specifies the directory where object files (*.o) should be stored.\n If not provided, object files are outputed to the source code", required=False)
-  argsParser.add_argument("-t", "--target", help="The path for the built executable of your project", required=True)
+  argsParser.add_argument("-t", "--target", help="The path for the built executable of your project", required=False)
   argsParser.add_argument("-ta", "--target-args", action=EqualAssignedArgument, metavar='="TARGET_ARGS ..."', help='Command-line arguments to pass to your built executable when it is restarted by schr.\nMust be used with direct affectation and quoted strings (eg -ta="-myflag value ...")', required=False)
-  argsParser.add_argument("-m", "--mode", action=ModeCharactersCombination, help='Configures schr behavior using a set of mode characters\n\tC - Automatically recompile on changes\n\tR - Restart the target after each build\ne.g. "-m CR" will enable both automatic compilation and restart\ndefaults to "CR"', required=False)
+  argsParser.add_argument("-tf", "--targets-file", help='Path to a json file describing several targets built from the same sources, each TU is compiled once and linked in every target using it.\ne.g. [{"target": "bin/server", "sources": ["src/lib/*", "src/server/*"], "lflags": "-lssl", "args": "--port 8080", "restart": true}]', required=False)
+  argsParser.add_argument("-m", "--mode", action=ModeCharactersCombination, help='Configures schr behavior using a set of mode characters\n\tC - Automatically recompile on changes\n\tR - Restart the target after each build\n\tT - Run the tests impacted by your changes after each build of a test target (see -tf)\ne.g. "-m CR" will enable both automatic compilation and restart\ndefaults to "CR"', required=False)
+  argsParser.add_argument("-ic", "--import-compile-commands", help="Path to a compilation database (compile_commands.json) giving the exact command of each source file.\nSource files missing from the database are compiled with -c and -cf", required=False)
+  argsParser.add_argument("-ec", "--export-compile-commands", help="Path where schr keeps an up to date compilation database (compile_commands.json) of your project, eg for clangd", required=False)
+  argsParser.add_argument("-j", "--jobs", type=int, help="Maximum number of compilations running in parallel on this machine\ndefaults to the number of CPUs", required=False)
+  argsParser.add_argument("-mb", "--memory-budget", type=int, help="Maximum memory in MiB used at once by the compilations running on this machine, based on the peak memory of their previous compilation\ndefaults to 80%% of the available memory", required=False)
+  argsParser.add_argument("-kc", "--keep-configurations", type=int, help="Number of build configurations (compiler and flags) whose object files are kept side by side in the object directory (see -od),\nswitching back to a kept configuration needs no recompilation\ndefaults to 4", required=False)
+  argsParser.add_argument("-w", "--workers", help='Comma separated list of schr-worker addresses to send compilations to (eg "buildbox1:7878,buildbox2:7878").\nCompilations fall back to this machine when a worker fails', required=False)
+  argsParser.add_argument("--partial-link", action='store_true', help="Partially links (-r) the objects of each directory into a cached relocatable object, so that after an edit only the group of the changed\nobject is relinked and the final link takes a few inputs\ndisabled by default", required=False)
   argsParser.add_argument("-d", "--debug", action='store_true', help="Enable schr debug mode which displays compiler/linker commands during execution\ndisabled by default", required=False)
+  argsParser.add_argument("--daemon", action='store_true', help="Listens for schr clients on a unix socket (.schr.sock) so that scripts and editors can query the build (see schr client -h)\ndisabled by default", required=False)
+  argsParser.add_argument("--poll", action='store_true', help="Detects changes by polling the project instead of inotify, for filesystems where inotify does not work (eg NFS)\nschr falls back to polling when inotify is not available\ndisabled by default", required=False)
+  argsParser.add_argument("--record", metavar="FILE", help="Records the filesystem events received by schr and the content of the source files they touch, to be replayed with schr replay FILE\ndisabled by default", required=False)
   argsParser.add_argument("--makefile", action='store_true', help="Outputs the source code for a makefile that can be used to invoke schr with the specified arguments\ndisabled by default", required=False)
-  args = argsParser.parse_args()
+  argsParser.add_argument("--ninja", nargs="?", const="build.ninja", metavar="FILE", help="Resolves the compilation graph and writes a build.ninja building every target without schr, then exits\nFILE defaults to build.ninja", required=False)
+  argsParser.add_argument("--static-makefile", nargs="?", const="schr.mk", metavar="FILE", help="Resolves the compilation graph and writes a makefile building every target without schr, then exits\nFILE defaults to schr.mk", required=False)
+  if is_analyze:
+    argsParser.add_argument("-o", "--output", default="schr-analysis.json", metavar="FILE", help="Path of the json report ranking headers by the compile time their edits cost per day, and the probably unused includes\ndefaults to schr-analysis.json", required=False)
+    argsParser.add_argument("--top", type=int, default=10, help="Number of headers and includes listed in the console summary\ndefaults to 10", required=False)
+  args = argsParser.parse_args(argv[2:] if is_analyze else argv[1:])
 
   hot_reloader_options = SimpleCppHotReloaderOptions({
     "WORKING_DIR": getcwd(),
@@ -75,12 +109,24 @@ def main():
     "CFLAGS": args.cflags or "",
     "LDFLAGS": args.lflags or "",
     "OBJ_DIR": "",
-    "CXX_FILE_EXTS": [".cpp", ".cc", ".c"],
+    "CXX_FILE_EXTS": [".cpp", ".cc", ".c", ".cppm", ".ixx"],
     "HXX_FILE_EXTS": [".hpp", ".h"],
-    "TARGET": args.target,
+    "TARGET": args.target or "",
     "TARGET_ARGS": args.target_args or "",
+    "TARGETS": [],
+    "TARGETS_FILE": "",
     "MODE": args.mode or "CR",
-    "DEBUG": args.debug
+    "DEBUG": args.debug,
+    "DAEMON": args.daemon,
+    "COMPDB_IMPORT": "",
+    "COMPDB_EXPORT": "",
+    "JOBS": cpu_count() or 1,
+    "WORKERS": [],
+    "MEMORY_BUDGET": 0,
+    "RECORD": "",
+    "POLLING": args.poll,
+    "KEEP_CONFIGURATIONS": 4,
+    "PARTIAL_LINK": args.partial_link
   })
 
   if cxx := args.compiler:
@@ -91,11 +137,174 @@ def main():
   if od := args.obj_dir:
     hot_reloader_options["OBJ_DIR"] = od
 
+  if ic := args.import_compile_commands:
+    if not path.isfile(ic):
+      argsParser.error(f'invalid -ic usage, "{ic}" is not a file.')
+    hot_reloader_options["COMPDB_IMPORT"] = path.abspath(ic)
+
+  if ec := args.export_compile_commands:
+    hot_reloader_options["COMPDB_EXPORT"] = path.abspath(ec)
+
+  if args.jobs is not None:
+    if args.jobs < 1:
+      argsParser.error("invalid -j usage, the number of jobs must be at least 1.")
+    hot_reloader_options["JOBS"] = args.jobs
+
+  if args.memory_budget is not None:
+    if args.memory_budget < 0:
+      argsParser.error("invalid -mb usage, the memory budget must be a positive number of MiB.")
+    hot_reloader_options["MEMORY_BUDGET"] = args.memory_budget << 20
+
+  if args.keep_configurations is not None:
+    if args.keep_configurations < 1:
+      argsParser.error("invalid -kc usage, at least 1 build configuration must be kept.")
+    hot_reloader_options["KEEP_CONFIGURATIONS"] = args.keep_configurations
+
+  if r := args.record:
+    hot_reloader_options["RECORD"] = path.abspath(r)
+
+  if w := args.workers:
+    workers = [worker.strip() for worker in w.split(",") if len(worker.strip())]
+    for worker in workers:
+      if not worker.rpartition(":")[2].isdigit():
+        argsParser.error(f'invalid -w usage, "{worker}" must be formatted as host:port.')
+    if not len(get_worker_token()):
+      argsParser.error(f"invalid -w usage, workers require the token they were started with in the {WORKER_TOKEN_ENV_VAR} environment variable.")
+    hot_reloader_options["WORKERS"] = workers
+
+  if tf := args.targets_file:
+    try:
+      hot_reloader_options["TARGETS"] = load_targets_file(tf)
+    except (OSError, ValueError) as e:
+      argsParser.error(f"invalid -tf usage, {e}")
+    hot_reloader_options["TARGETS_FILE"] = tf
+    if args.target:
+      hot_reloader_options["TARGETS"].insert(0, {
+        "TARGET": args.target,
+        "TARGET_ARGS": args.target_args or "",
+        "LDFLAGS": "",
+        "SOURCES": [],
+        "RESTART": True,
+        "TEST": False,
+        "TEST_SOURCES": [],
+        "GTEST": False
+      })
+  elif not args.target and not is_analyze:
+    argsParser.error("the following arguments are required: -t/--target (or -tf/--targets-file)")
+
+  if is_analyze:
+    analyze_project(hot_reloader_options, args.output, args.top)
+    exit(0)
+
   if args.makefile:
     print(as_makefile(hot_reloader_options))
     exit(0)
 
+  if args.ninja or args.static_makefile:
+    write_build_files(hot_reloader_options, args.ninja, args.static_makefile)
+    exit(0)
+
   HotReloader(hot_reloader_options).start()
 
+def write_build_files(options : SimpleCppHotReloaderOptions, ninja_file_path : Union[str, None], makefile_path : Union[str, None]):
+  logger = Logger(LoggerOptions.DefaultWithName("schr"))
+  cpp = CppUtils(options)
+  compilation_graph = CompilationGraph(options, cpp, logger, None)
+
+  if ninja_file_path:
+    regenerate_inputs = [p for p in [options["TARGETS_FILE"], options["COMPDB_IMPORT"]] if len(p)]
+    with open(ninja_file_path, "w") as fd:
+      fd.write(as_ninja(compilation_graph, cpp, list(argv), regenerate_inputs, ninja_file_path))
+    logger.success(f"wrote {ninja_file_path}")
+
+  if makefile_path:
+    with open(makefile_path, "w") as fd:
+      fd.write(as_static_makefile(compilation_graph, cpp))
+    logger.success(f"wrote {makefile_path}")
+
+def analyze_project(options : SimpleCppHotReloaderOptions, output_file_path : str, top : int):
+  logger = Logger(LoggerOptions.DefaultWithName("schr"))
+  cpp = CppUtils(options)
+  compilation_graph = CompilationGraph(options, cpp, logger, None)
+
+  logger.info("analyzing rebuild costs")
+  report = RebuildCostAnalyzer(compilation_graph, compilation_graph.get_compilation_history(), options).analyze()
+  with open(output_file_path, "w") as fd:
+    fd.write(dumps(report, indent=2))
+
+  logger.info(f"most expensive headers over {report['observed_days']} days (estimated TU duration {report['default_duration']}s):")
+  for header in report["headers"][:top]:
+    logger.info(f"  {header['header']}: {header['dependent_tus']} TUs, {header['triggered_compile_time']}s per edit, {header['edits_per_day']} edits/day, {header['cost_per_day']}s/day")
+  if len(report["unused_includes"]):
+    logger.warn("probably unused includes:")
+    for include in report["unused_includes"][:top]:
+      logger.warn(f"  {include['includer']}:{include['line']} {include['header']}: {include['removed_tus']} TUs, {include['saved_compile_time']}s per edit, {include['saved_cost_per_day']}s/day")
+  logger.success(f"wrote {output_file_path}")
+
+def replay_main(replay_argv : List[str]):
+  argsParser = ArgumentParser(usage="schr replay", description="Replays a session recorded with schr --record on a copy of the recorded tree and reports the build latency of each burst of events", formatter_class=RawTextHelpFormatter)
+  argsParser.add_argument("record", help="Path to the record file")
+  argsParser.add_argument("-d", "--dir", help="Empty directory where the recorded tree is restored\ndefaults to a new temporary directory", required=False)
+  argsParser.add_argument("--speed", type=float, default=0, help="Factor applied to the recorded delays between events, 1 replays them in real time\ndefaults to 0, each burst is replayed as soon as the previous one is built", required=False)
+  argsParser.add_argument("--burst-gap", type=float, default=0.5, help="Events less than this many seconds apart belong to the same burst\ndefaults to 0.5", required=False)
+  argsParser.add_argument("--timeout", type=float, default=600, help="Maximum number of seconds to wait for the build of a burst\ndefaults to 600", required=False)
+  argsParser.add_argument("--json", metavar="FILE", help="Writes the latency of each burst to FILE", required=False)
+  args = argsParser.parse_args(replay_argv)
+
+  replay_dir = path.abspath(args.dir or mkdtemp(prefix="schr-replay-"))
+  logger = Logger(LoggerOptions.DefaultWithName("schr"))
+  try:
+    replayer = EventReplayer(path.abspath(args.record), replay_dir, logger)
+  except (OSError, ValueError) as e:
+    argsParser.error(f"invalid record, {e}")
+
+  logger.info(f"restoring recorded tree in \"{replay_dir}\"")
+  replayer.restore_snapshot()
+  chdir(replay_dir)
+
+  results = replayer.replay(HotReloader(replayer.get_options()), args.speed, args.burst_gap, args.timeout)
+  if args.json:
+    with open(args.json, "w") as fd:
+      fd.write(dumps(results, indent=2))
+
+def client_main(client_argv : List[str]):
+  argsParser = ArgumentParser(usage="schr client", description="Queries a schr instance started with --daemon in the current directory", formatter_class=RawTextHelpFormatter)
+  argsParser.add_argument("command", choices=["status", "build", "wait", "dirty", "diagnostics"], help="status - is the build green, dirty nodes and targets state\nbuild - triggers a build now\nwait - waits for the next successful link\ndirty - lists outdated source files\ndiagnostics - last compiler and linker diagnostics")
+  argsParser.add_argument("-s", "--socket", help="Path to the schr socket\ndefaults to ./.schr.sock", default=f"{getcwd()}{sep}.schr.sock", required=False)
+  argsParser.add_argument("--timeout", type=float, help="Maximum number of seconds to wait for with the wait command\nwaits forever by default", required=False)
+  args = argsParser.parse_args(client_argv)
+
+  arguments = {"timeout": args.timeout} if args.command == "wait" and args.timeout is not None else {}
+  try:
+    response = DaemonClient(args.socket).request(args.command, **arguments)
+  except (OSError, ConnectionError) as e:
+    print(dumps({"status": "error", "error": str(e)}))
+    exit(2)
+
+  print(dumps(response))
+  if response.get("status") != "ok" or (args.command == "status" and not response.get("green")):
+    exit(1)
+
+def worker_main():
+  argsParser = ArgumentParser(usage="schr-worker", description="Simple CPP Hot Reloader compile worker (schr-worker)", formatter_class=RawTextHelpFormatter)
+  argsParser.add_argument("-H", "--host", help="Address to listen on, use 0.0.0.0 to accept other machines\ndefaults to 127.0.0.1", default="127.0.0.1", required=False)
+  argsParser.add_argument("-p", "--port", type=int, help="Port to listen on\ndefaults to 7878", default=7878, required=False)
+  argsParser.add_argument("-j", "--jobs", type=int, help="Maximum number of compilations running in parallel on this worker\ndefaults to the number of CPUs", default=0, required=False)
+  argsParser.add_argument("-c", "--compilers", help='Comma separated list of compilers schr clients are allowed to use\ndefaults to "g++,gcc,c++,cc,clang,clang++"', default="g++,gcc,c++,cc,clang,clang++", required=False)
+  argsParser.add_argument("-t", "--token", help=f"Secret schr clients must send with each request, schr reads it from the {WORKER_TOKEN_ENV_VAR} environment variable\ndefaults to ${WORKER_TOKEN_ENV_VAR}", default=get_worker_token(), required=False)
+  args = argsParser.parse_args()
+
+  if not len(args.token):
+    argsParser.error(f"a token is required, set -t or the {WORKER_TOKEN_ENV_VAR} environment variable.")
+
+  worker = CompileWorker(args.host, args.port, args.token, args.jobs, [c.strip() for c in args.compilers.split(",") if len(c.strip())])
+  worker.logger.info(f"listening on {worker.get_address()} with {worker.slots} slots")
+  try:
+    worker.serve_forever()
+  except KeyboardInterrupt:
+    print()
+  finally:
+    worker.server_close()
+
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,205 @@
+from __future__ import annotations
+from os.path import dirname, join, normpath, relpath, sep
+from re import DOTALL, MULTILINE, Match, compile as compile_regex
+from statistics import median
+from time import time
+from typing import Dict, FrozenSet, List, Set, Tuple, Union
+
+from ..compilation.compilation_graph import CompilationGraph, CompilationGraphSimpleNode
+from ..compilation.compilation_history import CompilationHistory
+from ..options import SimpleCppHotReloaderOptions
+
+# Comments and literals are matched together so that quotes in comments and slashes in strings are not mistaken for each other
+COMMENT_OR_LITERAL_REGEX = compile_regex(r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", DOTALL)
+INCLUDE_REGEX = compile_regex(r"^[ \t]*#[ \t]*include[ \t]*\"([^\"]+)\"", MULTILINE)
+INCLUDE_LINE_REGEX = compile_regex(r"^[ \t]*#[ \t]*include[^\n]*", MULTILINE)
+IDENTIFIER_REGEX = compile_regex(r"\b[A-Za-z_]\w*\b")
+DECLARATION_REGEXES = [
+  compile_regex(r"\b(?:class|struct|union|enum(?:\s+class|\s+struct)?|concept)\s+(?:\[\[.*?\]\]\s*)?([A-Za-z_]\w*)"),
+  compile_regex(r"^[ \t]*#[ \t]*define[ \t]+([A-Za-z_]\w*)", MULTILINE),
+  compile_regex(r"\busing\s+([A-Za-z_]\w*)\s*="),
+  compile_regex(r"\btypedef\b[^;{]*?([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)?;"),
+  compile_regex(r"\b(?:extern|constexpr|inline|static)\b[^;=({]*?\b([A-Za-z_]\w*)\s*(?:=|;|\{|\[)"),
+  compile_regex(r"\b([A-Za-z_]\w*)\s*\(")
+]
+ENUM_BODY_REGEX = compile_regex(r"\benum\b[^{;]*\{([^}]*)\}")
+# Followed by a parenthesis without being declared
+NOT_DECLARED_IDENTIFIERS = frozenset(["if", "for", "while", "switch", "return", "sizeof", "alignof", "alignas", "decltype", "static_assert", "catch", "noexcept", "defined", "operator", "throw", "new", "delete", "typeid", "requires", "int", "char", "bool", "float", "double", "void", "long", "short", "unsigned", "signed", "auto", "const", "static", "inline", "constexpr", "extern"])
+
+SECONDS_PER_DAY = 24 * 3600
+
+def strip_comments(match : Match) -> str :
+  # Line breaks are kept for the line numbers of the include directives
+  return match.group(0) if match.group(0)[0] in "\"'" else "\n" * match.group(0).count("\n") or " "
+
+def strip_comments_and_literals(match : Match) -> str :
+  return "\"\"" if match.group(0)[0] in "\"'" else "\n" * match.group(0).count("\n") or " "
+
+class SourceFileSummary:
+  """
+  Identifiers declared and used by a source file, and its quoted include directives with their line
+  """
+
+  __slots__ = ("declared", "used", "includes")
+
+  declared : FrozenSet[str]
+  used : FrozenSet[str]
+  includes : List[Tuple[str, int]]
+
+  def __init__(self, cpp_source_path : str):
+    try:
+      with open(cpp_source_path, "r", errors="replace") as fd:
+        source = fd.read()
+    except OSError:
+      source = ""
+
+    source_without_comments = COMMENT_OR_LITERAL_REGEX.sub(strip_comments, source)
+    self.includes = [(match.group(1), source_without_comments.count("\n", 0, match.start()) + 1) for match in INCLUDE_REGEX.finditer(source_without_comments)]
+
+    code = COMMENT_OR_LITERAL_REGEX.sub(strip_comments_and_literals, source)
+    declared = set()
+    for declaration_regex in DECLARATION_REGEXES:
+      declared.update(declaration_regex.findall(code))
+    for enum_body in ENUM_BODY_REGEX.findall(code):
+      declared.update(enumerator.group(0) for enumerator in (IDENTIFIER_REGEX.search(e) for e in enum_body.split(",")) if not enumerator is None)
+    self.declared = frozenset(declared - NOT_DECLARED_IDENTIFIERS)
+    self.used = frozenset(IDENTIFIER_REGEX.findall(INCLUDE_LINE_REGEX.sub("", code)))
+
+class RebuildCostAnalyzer:
+  """
+  Combines the include graph with the compilation durations and edit times of the compilation history to rank headers by the compile time their edits trigger,
+  and looks for include directives whose header is probably unused by the including file
+  """
+
+  def __init__(self, compilation_graph : CompilationGraph, compilation_history : CompilationHistory, options : SimpleCppHotReloaderOptions):
+    self._compilation_graph = compilation_graph
+    self._compilation_history = compilation_history
+    self._working_dir = options["WORKING_DIR"]
+
+    self._summaries : Dict[str, SourceFileSummary] = {}
+    self._direct_includes : Dict[str, List[Tuple[CompilationGraphSimpleNode, int]]] = {}
+    self._closures : Dict[str, Set[str]] = {}
+
+  def _relpath(self, key : str) -> str :
+    return relpath(key, self._working_dir)
+
+  def _get_summary(self, node : CompilationGraphSimpleNode) -> SourceFileSummary :
+    if not node.key in self._summaries:
+      self._summaries[node.key] = SourceFileSummary(node.key)
+    return self._summaries[node.key]
+
+  def get_direct_includes(self, node : CompilationGraphSimpleNode) -> List[Tuple[CompilationGraphSimpleNode, int]] :
+    """
+    Resolves the include directives of node to graph nodes, the graph includes are transitive since they come from the preprocessor
+    """
+    if not node.key in self._direct_includes:
+      direct_includes = []
+      for include, line in self._get_summary(node).includes:
+        relative_path = join(dirname(node.key), include)
+        resolved_node = self._compilation_graph.get_node(normpath(relative_path))
+        if resolved_node is None:
+          # Found through an include path (-I), the directive is a suffix of the include
+          suffix = f"{sep}{normpath(include)}"
+          resolved_node = next((n for n in node.includes if n.key.endswith(suffix)), None)
+        if not resolved_node is None and not resolved_node is node:
+          direct_includes.append((resolved_node, line))
+      self._direct_includes[node.key] = direct_includes
+    return self._direct_includes[node.key]
+
+  def _get_closure(self, node : CompilationGraphSimpleNode, skipped_edge : Union[Tuple[str, str], None] = None) -> Set[str] :
+    """
+    Keys of the headers reached by the include directives of node, optionally without the include of skipped_edge[1] by skipped_edge[0]
+    """
+    if skipped_edge is None and node.key in self._closures:
+      return self._closures[node.key]
+
+    closure = set()
+    nodes_to_visit = [node]
+    while len(nodes_to_visit):
+      visited_node = nodes_to_visit.pop()
+      for included_node, _ in self.get_direct_includes(visited_node):
+        if (visited_node.key, included_node.key) == skipped_edge or included_node.key in closure:
+          continue
+        closure.add(included_node.key)
+        nodes_to_visit.append(included_node)
+
+    if skipped_edge is None:
+      self._closures[node.key] = closure
+    return closure
+
+  def _is_probably_unused(self, includer : CompilationGraphSimpleNode, header : CompilationGraphSimpleNode) -> bool :
+    declared = set(self._get_summary(header).declared)
+    for key in self._get_closure(header):
+      if not (node := self._compilation_graph.get_node(key)) is None:
+        declared.update(self._get_summary(node).declared)
+    # Nothing recognized as a declaration, the header may still be needed (e.g. only macros of an external header)
+    return len(declared) > 0 and declared.isdisjoint(self._get_summary(includer).used)
+
+  def analyze(self) -> Dict :
+    now = time()
+    translation_units = self._compilation_graph.get_all_non_header_nodes()
+    headers = self._compilation_graph.get_all_header_nodes()
+
+    compilations = self._compilation_history.get_all()
+    known_durations = [compilations[node.key]["DURATION"] for node in translation_units if node.key in compilations]
+    default_duration = median(known_durations) if len(known_durations) else 0.0
+    durations = {node.key: compilations[node.key]["DURATION"] if node.key in compilations else default_duration for node in translation_units}
+
+    edits = self._compilation_history.get_all_edits()
+    first_edit = min((edited_at for edit_times in edits.values() for edited_at in edit_times), default=now)
+    observed_days = max((now - first_edit) / SECONDS_PER_DAY, 1.0)
+    edit_rates = {key: len(edit_times) / observed_days for key, edit_times in edits.items()}
+
+    header_reports = []
+    for header in headers:
+      dependent_tus = [node for node in self._compilation_graph.get_dependent_nodes(header) if not node.is_header]
+      triggered_compile_time = sum(durations[node.key] for node in dependent_tus)
+      header_reports.append({
+        "header": self._relpath(header.key),
+        "dependent_tus": len(dependent_tus),
+        "estimated_tus": sum(1 for node in dependent_tus if not node.key in compilations),
+        "triggered_compile_time": round(triggered_compile_time, 3),
+        "edits": len(edits.get(header.key, [])),
+        "edits_per_day": round(edit_rates.get(header.key, 0.0), 3),
+        "cost_per_day": round(edit_rates.get(header.key, 0.0) * triggered_compile_time, 3)
+      })
+    header_reports.sort(key=lambda r: (r["cost_per_day"], r["triggered_compile_time"], r["dependent_tus"]), reverse=True)
+
+    unused_include_reports = []
+    for includer in self._compilation_graph.get_all_nodes():
+      for header, line in self.get_direct_includes(includer):
+        if not header.is_header or not self._is_probably_unused(includer, header):
+          continue
+
+        affected_tus = [node for node in self._compilation_graph.get_dependent_nodes(includer) if not node.is_header]
+        if not includer.is_header:
+          affected_tus.append(includer)
+
+        removed_tus = 0
+        saved_compile_time = 0.0
+        saved_cost_per_day = 0.0
+        for node in affected_tus:
+          lost_headers = self._get_closure(node) - self._get_closure(node, (includer.key, header.key))
+          if header.key in lost_headers:
+            removed_tus += 1
+            saved_compile_time += durations[node.key]
+          saved_cost_per_day += durations[node.key] * sum(edit_rates.get(key, 0.0) for key in lost_headers)
+
+        unused_include_reports.append({
+          "includer": self._relpath(includer.key),
+          "header": self._relpath(header.key),
+          "line": line,
+          "removed_tus": removed_tus,
+          "saved_compile_time": round(saved_compile_time, 3),
+          "saved_cost_per_day": round(saved_cost_per_day, 3)
+        })
+    unused_include_reports.sort(key=lambda r: (r["saved_cost_per_day"], r["saved_compile_time"], r["removed_tus"]), reverse=True)
+
+    return {
+      "generated_at": round(now, 3),
+      "observed_days": round(observed_days, 2),
+      "translation_units": len(translation_units),
+      "default_duration": round(default_duration, 3),
+      "headers": header_reports,
+      "unused_includes": unused_include_reports
+    }
@@ -0,0 +1,134 @@
+from hashlib import blake2b
+from json import load, dump, JSONDecodeError
+from os import replace, stat
+from os.path import exists, join, realpath
+from shutil import rmtree, which
+from threading import Lock
+from time import time
+from typing import Dict, List, TypedDict, Union
+
+from ..options import SimpleCppHotReloaderOptions
+
+class BuildConfiguration(TypedDict):
+  CXX: str
+  CFLAGS: str
+  LDFLAGS: str
+  COMPDB_IMPORT: str
+  USED_AT: float
+
+def get_build_configuration_key(options : SimpleCppHotReloaderOptions) -> str :
+  """
+  Short digest of everything that changes the content of the object files: the compiler executable (an upgrade changes its mtime), the flags and the imported compilation database
+  """
+  hash = blake2b(digest_size=6)
+  compiler_path = which(options["CXX"]) or options["CXX"]
+  try:
+    compiler_stat = stat(realpath(compiler_path))
+    compiler_id = f"{realpath(compiler_path)}:{compiler_stat.st_mtime_ns}:{compiler_stat.st_size}"
+  except OSError:
+    compiler_id = compiler_path
+  for value in [compiler_id, options["CFLAGS"] or "", options["LDFLAGS"] or ""]:
+    hash.update(value.encode())
+    hash.update(b"\0")
+  if len(options["COMPDB_IMPORT"]):
+    try:
+      with open(options["COMPDB_IMPORT"], "rb") as fd:
+        hash.update(fd.read())
+    except OSError:
+      pass
+  return hash.hexdigest()
+
+class BuildConfigurations:
+  """
+  Index of the build configurations whose object files are kept side by side in their own directory of the object directory,
+  with the configuration each target was last linked with, since a target is linked at a single path for every configuration
+  """
+
+  _configurations : Dict[str, BuildConfiguration]
+  _linked_targets : Dict[str, str]
+
+  def __init__(self, build_configurations_file_path : str, objects_root_dir : Union[str, None]):
+    self._build_configurations_file_path = build_configurations_file_path
+    self._objects_root_dir = objects_root_dir
+    self._lock = Lock()
+
+    try:
+      with open(self._build_configurations_file_path, "r") as fd:
+        raw_index = load(fd)
+      self._configurations = {
+        key: {
+          "CXX": configuration["cxx"],
+          "CFLAGS": configuration["cflags"],
+          "LDFLAGS": configuration["ldflags"],
+          "COMPDB_IMPORT": configuration["compdb_import"],
+          "USED_AT": float(configuration["used_at"])
+        }
+        for key, configuration in raw_index["configurations"].items()
+      }
+      self._linked_targets = {target: key for target, key in raw_index["targets"].items()}
+    except (OSError, JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+      self._configurations = {}
+      self._linked_targets = {}
+
+  def get(self, key : str) -> Union[BuildConfiguration, None] :
+    with self._lock:
+      return self._configurations.get(key, None)
+
+  def use(self, key : str, options : SimpleCppHotReloaderOptions, keep : int) -> List[str] :
+    """
+    Marks key as the most recently used configuration, then removes the object files of the least recently used configurations beyond keep.
+    Returns the keys of the removed configurations
+    """
+    with self._lock:
+      self._configurations[key] = {
+        "CXX": options["CXX"],
+        "CFLAGS": options["CFLAGS"] or "",
+        "LDFLAGS": options["LDFLAGS"] or "",
+        "COMPDB_IMPORT": options["COMPDB_IMPORT"],
+        "USED_AT": time()
+      }
+      removed_keys = sorted(self._configurations, key=lambda k: self._configurations[k]["USED_AT"], reverse=True)[max(keep, 1):]
+      for removed_key in removed_keys:
+        del self._configurations[removed_key]
+        self._linked_targets = {target: linked_key for target, linked_key in self._linked_targets.items() if linked_key != removed_key}
+
+    if not self._objects_root_dir is None:
+      for removed_key in removed_keys:
+        if exists(join(self._objects_root_dir, removed_key)):
+          rmtree(join(self._objects_root_dir, removed_key), ignore_errors=True)
+
+    self.write()
+    return removed_keys
+
+  def is_linked_with(self, target : str, key : str) -> bool :
+    with self._lock:
+      return self._linked_targets.get(target, None) == key
+
+  def record_link(self, target : str, key : str) -> None :
+    with self._lock:
+      if self._linked_targets.get(target, None) == key:
+        return
+      self._linked_targets[target] = key
+    self.write()
+
+  def write(self) -> None :
+    with self._lock:
+      raw_index = {
+        "configurations": {
+          key: {
+            "cxx": configuration["CXX"],
+            "cflags": configuration["CFLAGS"],
+            "ldflags": configuration["LDFLAGS"],
+            "compdb_import": configuration["COMPDB_IMPORT"],
+            "used_at": round(configuration["USED_AT"], 3)
+          }
+          for key, configuration in self._configurations.items()
+        },
+        "targets": dict(sorted(self._linked_targets.items()))
+      }
+
+      # Targets may be linked concurrently, the lock also protects the temporary file
+      tmp_path = f"{self._build_configurations_file_path}.tmp"
+      with open(tmp_path, "w") as fd:
+        dump(raw_index, fd, indent=2)
+      replace(tmp_path, self._build_configurations_file_path)
@@ -1,63 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hashlib import blake2b
-from os import path
-from typing import List
+from mmap import mmap, ACCESS_READ
+from os import path, cpu_count, fstat, makedirs, replace
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Tuple, Union
 
 from ..compilation.compilation_graph import CompilationGraph, CompilationGraphSimpleNode
+from ..utils.logger import Logger
 
-class CompilationCacheNode:
+# Files above this size are hashed through a memory map instead of being copied in a python buffer
+MMAP_THRESHOLD = 1 << 20
 
-  def __init__(self, node : CompilationGraphSimpleNode):
-    self._node = node
-    self._node_hash = self._hash()
+def hash_file(file_path : str) -> bytes :
+  return hash_file_with_size(file_path)[0]
 
-  def _hash(self):
-    hash = blake2b()
-    with open(self._node.key, "rb") as fd:
-      while chunk := fd.read(8192):
-        hash.update(chunk)
-    return hash.digest().hex()
-  
-  def is_up_to_date(self) -> bool:
-    return self._node_hash == self._hash()
-
-  def update(self) -> None:
-    self._node_hash = self._hash()
+def hash_file_with_size(file_path : str) -> Tuple[bytes, int] :
+  hash = blake2b()
+  with open(file_path, "rb") as fd:
+    size = fstat(fd.fileno()).st_size
+    if size >= MMAP_THRESHOLD:
+      with mmap(fd.fileno(), 0, access=ACCESS_READ) as mapped_file:
+        hash.update(mapped_file)
+    else:
+      hash.update(fd.read())
+  return hash.digest(), size
 
 class CompilationCache:
+  """
+  Raw blake2b digests of the graph nodes indexed by node key, digests are only hex encoded in the cache file.
+  The cache file starts with the build configuration of the object files, a cache of another configuration is ignored
+  """
+
+  PROGRESS_INTERVAL = 1
 
-  def __init__(self, compilation_graph : CompilationGraph, compilation_cache_file_path : str):
+  _digests : Dict[str, bytes]
+
+  def __init__(self, compilation_graph : CompilationGraph, compilation_cache_file_path : str, build_configuration_key : str, logger : Union[Logger, None] = None):
+    self._compilation_graph = compilation_graph
     self._compilation_cache_file_path = compilation_cache_file_path
-    self._cache_table = {node.key: CompilationCacheNode(node) for node in compilation_graph.get_all_nodes()}
+    self._build_configuration_key = build_configuration_key
+    self._logger = logger
+    self._write_lock = Lock()
+    self._digests = self._hash_all([node.key for node in compilation_graph.get_all_nodes()])
+
+  def _hash_all(self, keys : List[str]) -> Dict[str, bytes] :
+    """
+    Hashes files in parallel, blake2b releases the GIL while hashing large buffers
+    """
+    digests = {}
+    hashed_bytes = 0
+    started_at = last_progress_at = perf_counter()
+
+    with ThreadPoolExecutor(max_workers=min(32, (cpu_count() or 1) * 4)) as executor:
+      futures = {executor.submit(hash_file_with_size, key): key for key in keys}
+      for future in as_completed(futures):
+        digests[futures[future]], size = future.result()
+        hashed_bytes += size
+        if not self._logger is None and perf_counter() - last_progress_at >= self.PROGRESS_INTERVAL:
+          last_progress_at = perf_counter()
+          self._logger.warn(f"{len(digests)}/{len(keys)} files hashed...")
+
+    if not self._logger is None:
+      elapsed = max(perf_counter() - started_at, 1e-6)
+      self._logger.info(f"{len(keys)} files hashed ({hashed_bytes / (1 << 20):.1f} MiB) in {elapsed:.2f}s, {hashed_bytes / (1 << 20) / elapsed:.1f} MiB/s")
+
+    return digests
 
   def insert_node(self, node : CompilationGraphSimpleNode) -> None :
-    self._cache_table[node.key] = CompilationCacheNode(node)
+    self._digests[node.key] = hash_file(node.key)
 
   def remove_node(self, node_key : str) -> None :
-    del self._cache_table[node_key]
+    del self._digests[node_key]
 
   def update_node(self, node_key : str) -> None :
-    self._cache_table[node_key].update()
+    self._digests[node_key] = hash_file(node_key)
 
   def move_node(self, old_node_key : str, new_node : CompilationGraphSimpleNode) -> None:
     self.remove_node(old_node_key)
     self.insert_node(new_node)
 
   def is_node_up_to_date(self, node_key : str) -> None :
-    return node_key in self._cache_table and self._cache_table[node_key].is_up_to_date()
+    return node_key in self._digests and self._digests[node_key] == hash_file(node_key)
 
-  def get_all_outdated_nodes(self) -> List[CompilationGraphSimpleNode]:
-    outdated_nodes = set(self._cache_table.keys())
+  def _read_cache_file(self) -> Dict[str, bytes] :
+    if not path.exists(self._compilation_cache_file_path):
+      return {}
 
-    if path.exists(self._compilation_cache_file_path):
-      with open(self._compilation_cache_file_path, "r") as fd:
-        for line in fd.readlines():
-          node_key, node_hash = line.replace("\n", "").split(":")
-          if node_key in self._cache_table and self._cache_table[node_key]._node_hash == node_hash:
-            outdated_nodes.remove(node_key)
+    with open(self._compilation_cache_file_path, "r") as fd:
+      lines = fd.read().splitlines()
 
-    return [self._cache_table[node_key]._node for node_key in outdated_nodes]
+    if not len(lines) or lines[0] != f"configuration:{self._build_configuration_key}":
+      # Objects were built with other flags (or by an older schr), every node is outdated
+      return {}
+
+    cached_digests = {}
+    for line in lines[1:]:
+      node_key, _, node_hash = line.rpartition(":")
+      cached_digests[node_key] = bytes.fromhex(node_hash)
+    return cached_digests
+
+  def get_all_outdated_nodes(self) -> List[CompilationGraphSimpleNode]:
+    cached_digests = self._read_cache_file()
+    outdated_nodes = [node_key for node_key, digest in self._digests.items() if cached_digests.get(node_key, None) != digest]
+    return [node for node in map(self._compilation_graph.get_node, outdated_nodes) if not node is None]
 
   def write_to_cache_file(self):
-    with open(self._compilation_cache_file_path, "w") as fd:
-      for node_key in self._cache_table:
-        fd.write(f"{node_key}:{self._cache_table[node_key]._node_hash}\n")
+    # Targets are linked concurrently, each one writes the cache when it succeeds
+    with self._write_lock:
+      makedirs(path.dirname(self._compilation_cache_file_path), exist_ok=True)
+      tmp_path = f"{self._compilation_cache_file_path}.tmp"
+      with open(tmp_path, "w") as fd:
+        fd.write(f"configuration:{self._build_configuration_key}\n")
+        fd.write("".join(f"{node_key}:{digest.hex()}\n" for node_key, digest in list(self._digests.items())))
+      replace(tmp_path, self._compilation_cache_file_path)
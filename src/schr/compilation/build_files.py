@@ -0,0 +1,114 @@
+from shlex import join
+from typing import List, Union
+
+from .compilation_graph import CompilationGraph, CompilationGraphSimpleNode
+from ..utils.cpp import CppUtils
+
+def ninja_escape_path(file_path : str) -> str :
+  return file_path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+def ninja_escape_command(command : List[str]) -> str :
+  return join(command).replace("$", "$$")
+
+def make_escape_path(file_path : str) -> str :
+  return file_path.replace("$", "$$").replace(" ", "\\ ").replace(":", "\\:")
+
+def make_escape_command(command : List[str]) -> str :
+  return join(command).replace("$", "$$")
+
+def get_header_dependencies(node : CompilationGraphSimpleNode) -> List[str] :
+  headers = set()
+  nodes_to_visit = list(node.includes)
+  while len(nodes_to_visit):
+    include = nodes_to_visit.pop()
+    if include.is_header and not include.key in headers:
+      headers.add(include.key)
+      nodes_to_visit.extend(include.includes)
+  return sorted(headers)
+
+def as_ninja(compilation_graph : CompilationGraph, cpp : CppUtils, regenerate_command : Union[List[str], None] = None, regenerate_inputs : List[str] = [], ninja_file_path : str = "build.ninja") -> str :
+  """
+  Outputs a build.ninja with one edge per TU (header dependencies from the graph, refined by the compiler depfile) and one link edge per target
+  """
+  lines = [
+    "# Generated by schr from the compilation graph, do not edit",
+    "ninja_required_version = 1.3",
+    "",
+    "rule cxx",
+    "  command = $compile_command -MMD -MF $out.d",
+    "  depfile = $out.d",
+    "  deps = gcc",
+    "  description = CXX $out",
+    "",
+    "rule link",
+    "  command = $link_command",
+    "  restat = 1",
+    "  description = LINK $out",
+    ""
+  ]
+
+  if not regenerate_command is None:
+    lines.extend([
+      "rule schr",
+      f"  command = {ninja_escape_command(regenerate_command)}",
+      "  generator = 1",
+      "  restat = 1",
+      "  description = SCHR $out",
+      "",
+      f"build {ninja_escape_path(ninja_file_path)}: schr{' | ' + ' '.join(map(ninja_escape_path, regenerate_inputs)) if len(regenerate_inputs) else ''}",
+      ""
+    ])
+
+  for node in sorted(compilation_graph.get_all_non_header_nodes(), key=lambda n: n.key):
+    # Module units are ordered after the units providing the modules they import, whose BMI comes with their object file
+    dependencies = get_header_dependencies(node) + [provider.object_file_path for provider in node.get_module_dependencies()]
+    lines.append(f"build {ninja_escape_path(node.object_file_path)}: cxx {ninja_escape_path(node.key)}{' | ' + ' '.join(map(ninja_escape_path, dependencies)) if len(dependencies) else ''}")
+    lines.append(f"  compile_command = {ninja_escape_command(cpp.get_compile_command(node.key))}")
+
+  lines.append("")
+
+  targets = compilation_graph.get_all_targets()
+  for target in targets:
+    object_file_paths = [node.object_file_path for node in sorted(target.get_all_nodes(), key=lambda n: n.key)]
+    lines.append(f"build {ninja_escape_path(target.key)}: link {' '.join(map(ninja_escape_path, object_file_paths))}")
+    lines.append(f"  link_command = {ninja_escape_command(cpp.get_link_command(object_file_paths, target.options))}")
+
+  lines.append("")
+  lines.append(f"default {' '.join(ninja_escape_path(target.key) for target in targets)}")
+
+  return "\n".join(lines) + "\n"
+
+def as_static_makefile(compilation_graph : CompilationGraph, cpp : CppUtils) -> str :
+  """
+  Outputs a makefile with one rule per TU, its header dependencies and one rule per target, without invoking schr
+  """
+  targets = compilation_graph.get_all_targets()
+  nodes = sorted(compilation_graph.get_all_non_header_nodes(), key=lambda n: n.key)
+
+  lines = [
+    "# Generated by schr from the compilation graph, do not edit",
+    f"all: {' '.join(make_escape_path(target.key) for target in targets)}",
+    ""
+  ]
+
+  for node in nodes:
+    # Module units are ordered after the units providing the modules they import, whose BMI comes with their object file
+    dependencies = get_header_dependencies(node) + [provider.object_file_path for provider in node.get_module_dependencies()]
+    lines.append(f"{make_escape_path(node.object_file_path)}: {' '.join(map(make_escape_path, [node.key, *dependencies]))}")
+    lines.append("\t@mkdir -p $(@D)")
+    lines.append(f"\t{make_escape_command(cpp.get_compile_command(node.key))}")
+    lines.append("")
+
+  for target in targets:
+    object_file_paths = [node.object_file_path for node in nodes if target.has_node(node)]
+    lines.append(f"{make_escape_path(target.key)}: {' '.join(map(make_escape_path, object_file_paths))}")
+    lines.append("\t@mkdir -p $(@D)")
+    lines.append(f"\t{make_escape_command(cpp.get_link_command(object_file_paths, target.options))}")
+    lines.append("")
+
+  lines.append("clean:")
+  lines.append(f"\trm -f {' '.join(make_escape_path(n.object_file_path) for n in nodes)} {' '.join(make_escape_path(t.key) for t in targets)}")
+  lines.append("")
+  lines.append(".PHONY: all clean")
+
+  return "\n".join(lines) + "\n"
@@ -0,0 +1,126 @@
+from json import load, dump
+from os import replace, makedirs
+from os.path import abspath, join, isabs, dirname
+from shlex import split
+from threading import Lock
+from typing import Dict, List, Union
+
+class CompilationDatabase:
+  """
+  Lazily loaded compile_commands.json index, commands are normalized (absolute paths, no input/output) and memoized per file
+  """
+
+  # Flags whose value is a path, either given as the next argument (-I dir) or joined (-Idir)
+  PATH_FLAGS = ["-I", "-isystem", "-iquote", "-idirafter", "-include", "-imacros", "-isysroot", "--sysroot"]
+  PREPROCESSOR_FLAGS = [*PATH_FLAGS, "-D", "-U", "-std", "-nostdinc", "-nostdinc++"]
+  OUTPUT_FLAGS = ["-o", "-MF", "-MT", "-MQ"]
+  DROPPED_FLAGS = ["-c", "-MD", "-MMD"]
+
+  _entries : Union[Dict[str, Dict], None] = None
+  _commands : Dict[str, Union[List[str], None]]
+
+  def __init__(self, compilation_database_path : str):
+    self._compilation_database_path = compilation_database_path
+    self._commands = {}
+    self._lock = Lock()
+
+  def _load(self) -> Dict[str, Dict] :
+    with self._lock:
+      if self._entries is None:
+        with open(self._compilation_database_path, "r") as fd:
+          raw_entries = load(fd)
+        self._entries = {abspath(join(entry["directory"], entry["file"])): entry for entry in raw_entries}
+      return self._entries
+
+  def get_command(self, cpp_source_path : str) -> Union[List[str], None] :
+    """
+    Returns the compiler followed by the flags used to compile cpp_source_path, None if the file is not in the database
+    """
+    cpp_source_path = abspath(cpp_source_path)
+    with self._lock:
+      if cpp_source_path in self._commands:
+        return self._commands[cpp_source_path]
+
+    entry = self._load().get(cpp_source_path, None)
+    command = None if entry is None else self._normalize(entry, cpp_source_path)
+
+    with self._lock:
+      self._commands[cpp_source_path] = command
+    return command
+
+  def get_preprocessor_flags(self, cpp_source_path : str) -> Union[List[str], None] :
+    command = self.get_command(cpp_source_path)
+    if command is None:
+      return None
+
+    flags = []
+    arguments = iter(command[1:])
+    for argument in arguments:
+      flag = next((f for f in self.PREPROCESSOR_FLAGS if argument == f or argument.startswith(f)), None)
+      if flag is None:
+        continue
+      flags.append(argument)
+      if argument == flag and flag in self.PATH_FLAGS + ["-D", "-U"]:
+        flags.append(next(arguments, ""))
+    return flags
+
+  def _normalize(self, entry : Dict, cpp_source_path : str) -> List[str] :
+    directory = entry["directory"]
+    raw_arguments = entry["arguments"] if "arguments" in entry else split(entry["command"])
+
+    command = [raw_arguments[0]]
+    arguments = iter(raw_arguments[1:])
+    for argument in arguments:
+      if argument in self.OUTPUT_FLAGS:
+        next(arguments, None)
+        continue
+      if argument in self.DROPPED_FLAGS or abspath(join(directory, argument)) == cpp_source_path:
+        continue
+
+      if argument in self.PATH_FLAGS:
+        command.extend([argument, self._absolute_path(directory, next(arguments, ""))])
+        continue
+
+      path_flag = next((f for f in self.PATH_FLAGS if argument.startswith(f) and len(argument) > len(f)), None)
+      if not path_flag is None:
+        raw_path = argument[len(path_flag):].lstrip("=")
+        command.append(f"{path_flag}{'=' if path_flag == '--sysroot' else ''}{self._absolute_path(directory, raw_path)}")
+        continue
+
+      command.append(argument)
+
+    return command
+
+  def _absolute_path(self, directory : str, raw_path : str) -> str :
+    return raw_path if isabs(raw_path) else abspath(join(directory, raw_path))
+
+class CompilationDatabaseWriter:
+  """
+  Keeps a compile_commands.json up to date as nodes are added or removed
+  """
+
+  _entries : Dict[str, Dict]
+
+  def __init__(self, compilation_database_path : str, directory : str):
+    self._compilation_database_path = compilation_database_path
+    self._directory = directory
+    self._entries = {}
+    self._lock = Lock()
+
+  def insert(self, cpp_source_path : str, command : List[str]) -> None :
+    with self._lock:
+      self._entries[cpp_source_path] = {"directory": self._directory, "file": cpp_source_path, "arguments": command}
+
+  def remove(self, cpp_source_path : str) -> None :
+    with self._lock:
+      self._entries.pop(cpp_source_path, None)
+
+  def write(self) -> None :
+    with self._lock:
+      entries = [self._entries[k] for k in sorted(self._entries)]
+
+    makedirs(dirname(abspath(self._compilation_database_path)), exist_ok=True)
+    tmp_path = f"{self._compilation_database_path}.tmp"
+    with open(tmp_path, "w") as fd:
+      dump(entries, fd, indent=2)
+    replace(tmp_path, self._compilation_database_path)
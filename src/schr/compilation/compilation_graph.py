@@ -1,72 +1,181 @@
 from __future__ import annotations
+from sys import intern
 from threading import Thread, Lock
-from typing import Set, Dict, List, Union, Callable
+from time import time
+from typing import AbstractSet, Dict, List, Sequence, Set, Tuple, Union, Callable
 
+from .compilation_history import CompilationHistory
+from .compilation_scheduler import CompilationScheduler
+from .partial_linker import PartialLinker
 from ..multithreading.async_process import AsyncProcess
 from ..multithreading.async_queue import AsyncQueue
 from ..multithreading.weighted_lock import WeightedLock
 from ..utils.cpp import CppUtils
 from ..utils.logger import Logger
-from ..options import SimpleCppHotReloaderOptions
+from ..options import SimpleCppHotReloaderOptions, SimpleCppHotReloaderTargetOptions, get_targets
+
+# Shared by nodes without edges or diagnostics, included_in sets are only allocated on first insertion
+EMPTY_INCLUDED_IN : AbstractSet = frozenset()
+EMPTY_DIAGNOSTICS : Sequence[str] = ()
 
 class CompilationGraphSimpleNode:
 
-  _compilation_process : Union[AsyncProcess, None] = None
-  includes: Set[CompilationGraphSimpleNode]
-  included_in: Set[CompilationGraphSimpleNode]
+  __slots__ = ("_compilation_graph", "key", "is_header", "is_up_to_date", "has_compilation_error", "diagnostics", "includes", "included_in", "module_name", "imported_modules")
+
+  includes: Sequence[CompilationGraphSimpleNode]
+  module_name: Union[str, None]
+  imported_modules: Sequence[str]
+  included_in: AbstractSet[CompilationGraphSimpleNode]
+  diagnostics: Sequence[str]
   
   def __init__(self, compilation_graph : CompilationGraph, key : str):
     self._compilation_graph = compilation_graph
-    self.key = key
+    self.key = intern(key)
     self.is_header = self._compilation_graph._cpp.is_header(self.key)
-    self.object_file_path = self._compilation_graph._cpp.get_object_file_path(self.key)
     self.is_up_to_date = self._compilation_graph._cpp.is_compiled(self.key)
 
-    self.includes = set()
-    self.included_in = set()
-
-    if not self.is_header:
-      self._compilation_process = AsyncProcess(
-        self._compilation_graph._cpp.get_compile_command(self.key),
-        {
-          "stderr_logger": print,
-          "on_success": self._on_compilation_success,
-          "on_error": self._on_compilation_error
-        }
-      )
+    self.has_compilation_error = False
+    self.diagnostics = EMPTY_DIAGNOSTICS
+
+    self.includes = ()
+    self.included_in = EMPTY_INCLUDED_IN
+
+    self.module_name = None
+    self.imported_modules = ()
+
+  @property
+  def object_file_path(self) -> str :
+    return self._compilation_graph._cpp.get_object_file_path(self.key)
+
+  def add_includes(self, nodes : List[CompilationGraphSimpleNode]) -> None :
+    with self._compilation_graph._edges_lock:
+      new_nodes = [node for node in dict.fromkeys(nodes) if not node in self.includes]
+      self.includes = (*self.includes, *new_nodes)
+      for node in new_nodes:
+        if node.included_in is EMPTY_INCLUDED_IN:
+          node.included_in = set()
+        node.included_in.add(self)
+        self._compilation_graph._invalidate_dependent_nodes(node)
+
+  def remove_include(self, node : CompilationGraphSimpleNode) -> None :
+    with self._compilation_graph._edges_lock:
+      self.includes = tuple(n for n in self.includes if not n is node)
+      if self in node.included_in:
+        node.included_in.discard(self)
+      self._compilation_graph._invalidate_dependent_nodes(node)
+
+  def clear_includes(self) -> None :
+    with self._compilation_graph._edges_lock:
+      for node in self.includes:
+        if self in node.included_in:
+          node.included_in.discard(self)
+        self._compilation_graph._invalidate_dependent_nodes(node)
+      self.includes = ()
 
   def _on_compilation_success(self) -> None :
     self.is_up_to_date = True
+    self.has_compilation_error = False
     self._compilation_graph._logger.info(f"{self.key} recompiled")
+    self._compilation_graph._outdate_targets(self)
     self._compilation_graph._weighted_lock.release(self.key)
-    self._compilation_graph._link_target()
+    self._compilation_graph.link_outdated_targets()
 
   def _on_compilation_error(self) -> None :
+    self.has_compilation_error = True
     self._compilation_graph._logger.error(f"{self.key} compilation error")
     self._compilation_graph._weighted_lock.release(self.key)
     self._compilation_graph._compilation_queue.enqueue(self)
 
+  def get_module_dependencies(self) -> List[CompilationGraphSimpleNode] :
+    """
+    Returns the project nodes providing the modules imported by this node, their BMI must be built first
+    """
+    return [provider for module_name in self.imported_modules if not (provider := self._compilation_graph.get_module_provider(module_name)) is None and not provider is self]
+
   def recompile(self, outdate_included_in : bool = True) -> None:
-    if not self.is_up_to_date:
-      if self.is_header:
-        for node in self.included_in:
-          if outdate_included_in:
-            node.is_up_to_date = False
-          node.recompile(outdate_included_in)
-        self.is_up_to_date = True
-      else:
-        self._compilation_graph._weighted_lock.acquire(self.key)
-        self._compilation_graph._cpp.create_object_file_dir(self.key)
-        self._compilation_process.terminate_and_run()
+    self._compilation_graph._submit_nodes(self._compilation_graph.get_nodes_to_recompile([self], outdate_included_in))
+
+class CompilationGraphTarget:
+
+  last_link_time : Union[float, None] = None
+  last_link_succeeded : Union[bool, None] = None
+  diagnostics : List[str]
+  _partial_link_thread : Union[Thread, None] = None
+
+  def __init__(self, compilation_graph : CompilationGraph, options : SimpleCppHotReloaderTargetOptions):
+    self._compilation_graph = compilation_graph
+    self.options = options
+    self.key = options["TARGET"]
+    self.diagnostics = []
+    self.is_up_to_date = self._compilation_graph._cpp.is_target_up_to_date(self.options, list(map(lambda n: n.object_file_path, self.get_all_nodes())))
+
+    self._link_process = AsyncProcess(
+      self._compilation_graph._cpp.get_link_command([], self.options),
+      {
+        "on_success": self._on_link_success,
+        "on_error": self._on_link_error,
+        "stderr_logger": self._log_diagnostic
+      }
+    )
+
+  def _log_diagnostic(self, line : str) -> None :
+    print(line)
+    self.diagnostics.append(line)
+
+  def is_linking(self) -> bool :
+    return self._link_process.is_running() or (not self._partial_link_thread is None and self._partial_link_thread.is_alive())
+
+  def has_node(self, node : CompilationGraphSimpleNode) -> bool :
+    return not node.is_header and self._compilation_graph._cpp.is_target_source(self.options, node.key)
+
+  def get_all_nodes(self) -> List[CompilationGraphSimpleNode] :
+    return list(filter(self.has_node, self._compilation_graph.get_all_non_header_nodes()))
+
+  def _on_link_success(self) -> None :
+    self.is_up_to_date = True
+    self.last_link_time = time()
+    self.last_link_succeeded = True
+    self._compilation_graph._on_link_success(self)
+
+  def _on_link_error(self) -> None :
+    self.last_link_time = time()
+    self.last_link_succeeded = False
+    self._compilation_graph._on_link_error(self)
+
+  def link(self) -> None :
+    object_file_paths = list(map(lambda n: n.object_file_path, self.get_all_nodes()))
+    if not self._partial_link_thread is None:
+      self._partial_link_thread.join()
+    self._link_process.terminate()
+    self.diagnostics = []
+
+    if self._compilation_graph._partial_linker is None:
+      self._link_process.run_with_command(self._compilation_graph._cpp.get_link_command(object_file_paths, self.options))
+      return
+
+    self._partial_link_thread = Thread(target=self._partial_link, args=(object_file_paths,), daemon=True)
+    self._partial_link_thread.start()
+
+  def _partial_link(self, object_file_paths : List[str]) -> None :
+    link_inputs = self._compilation_graph._partial_linker.link_groups(self.key, object_file_paths, self._log_diagnostic)
+    if link_inputs is None:
+      self._on_link_error()
+      return
+    self._link_process.run_with_command(self._compilation_graph._cpp.get_link_command(link_inputs, self.options))
 
 class CompilationGraph:
 
   _nodes : Dict[str, CompilationGraphSimpleNode]
   _visited : Set[str]
   _compilation_queue : AsyncQueue[CompilationGraphSimpleNode]
-  _link_process : AsyncProcess
-
-  def __init__(self, options: SimpleCppHotReloaderOptions, cpp : CppUtils, logger: Logger, on_build_graph_success : Union[Callable[[], None], None]):
+  _targets : List[CompilationGraphTarget]
+  # Memoized reverse transitive closure of the include edges, indexed by node key
+  _dependent_nodes : Dict[str, Tuple[CompilationGraphSimpleNode, ...]]
+  _module_providers : Dict[str, CompilationGraphSimpleNode]
+  # Nodes importing each module name, dicts keep the order of insertion
+  _module_importers : Dict[str, Dict[CompilationGraphSimpleNode, None]]
+
+  def __init__(self, options: SimpleCppHotReloaderOptions, cpp : CppUtils, logger: Logger, on_build_graph_success : Union[Callable[[CompilationGraphTarget], None], None]):
     self._options = options
     self._cpp = cpp
 
@@ -74,19 +183,30 @@ class CompilationGraph:
 
     self._nodes = {}
     self._nodes_lock = Lock()
+    self._edges_lock = Lock()
+    self._dependent_nodes = {}
+    self._module_providers = {}
+    self._module_importers = {}
+    self._is_initialized = False
     self._visited = set()
     self._compilation_queue = AsyncQueue([])
     self._weighted_lock = WeightedLock()
+    self._compilation_history = CompilationHistory(self._cpp.get_compilation_history_file_path())
+    self._compilation_scheduler = CompilationScheduler(
+      self._cpp,
+      self._logger,
+      self._options["JOBS"],
+      self._options["WORKERS"],
+      self._options["MEMORY_BUDGET"],
+      self._compilation_history,
+      lambda n: n._on_compilation_success(),
+      lambda n: n._on_compilation_error()
+    )
+
+    self._partial_linker = PartialLinker(self._cpp, self._logger, self._options["JOBS"]) if self._options["PARTIAL_LINK"] else None
 
     self._on_build_graph_success = on_build_graph_success
-    self._link_process = AsyncProcess(
-      self._cpp.get_link_command([]),
-      {
-        "on_success": self._on_link_success,
-        "on_error": self._on_link_error,
-        "stderr_logger": print
-      }
-    )
+    self._targets = []
 
     keys_to_visit = self._cpp.get_cpp_source_file()
 
@@ -115,10 +235,15 @@ class CompilationGraph:
         t.join()
 
       for new_node in visited_nodes:
-        keys_to_visit = [*keys_to_visit, *[node.key for node in new_node.includes]]
+        keys_to_visit.extend(node.key for node in new_node.includes)
+
+    self._targets = [CompilationGraphTarget(self, target) for target in get_targets(self._options)]
+    self._is_initialized = True
 
+    # Nodes were created before their module was scanned, so their BMI was not checked yet
     for node in self.get_all_non_header_nodes():
       if not self._cpp.is_compiled(node.key):
+        node.is_up_to_date = False
         self._compilation_queue.enqueue(node)
 
   def has_node(self, key : str) -> bool :
@@ -144,6 +269,132 @@ class CompilationGraph:
   def get_all_non_header_nodes(self) -> List[CompilationGraphSimpleNode] :
     return list(filter(lambda n : not n.is_header, self.get_all_nodes()))
 
+  def get_all_outdated_nodes(self) -> List[CompilationGraphSimpleNode] :
+    return list(filter(lambda n : not n.is_up_to_date, self.get_all_non_header_nodes()))
+
+  def is_building(self) -> bool :
+    return not self._compilation_scheduler.is_idle() or any(target.is_linking() for target in self._targets)
+
+  def get_all_targets(self) -> List[CompilationGraphTarget] :
+    return list(self._targets)
+
+  def get_compilation_history(self) -> CompilationHistory :
+    return self._compilation_history
+
+  def get_dependent_nodes(self, node : CompilationGraphSimpleNode) -> Tuple[CompilationGraphSimpleNode, ...] :
+    """
+    Returns every node including node, directly or through other headers, each node appears once
+    """
+    with self._edges_lock:
+      dependent_nodes = self._dependent_nodes.get(node.key, None)
+      if dependent_nodes is None:
+        closure = {}
+        nodes_to_visit = [node]
+        while len(nodes_to_visit):
+          for included_in in nodes_to_visit.pop().included_in:
+            if not included_in in closure and not included_in is node:
+              closure[included_in] = None
+              nodes_to_visit.append(included_in)
+        dependent_nodes = tuple(closure)
+        self._dependent_nodes[node.key] = dependent_nodes
+      return dependent_nodes
+
+  def _invalidate_dependent_nodes(self, node : CompilationGraphSimpleNode) -> None :
+    """
+    An include edge to node changed, only the closures of node and of the nodes it includes can contain it, must be called with the edges lock held
+    """
+    if not len(self._dependent_nodes):
+      return
+    visited_keys = set()
+    nodes_to_visit = [node]
+    while len(nodes_to_visit):
+      visited_node = nodes_to_visit.pop()
+      if visited_node.key in visited_keys:
+        continue
+      visited_keys.add(visited_node.key)
+      self._dependent_nodes.pop(visited_node.key, None)
+      nodes_to_visit.extend(visited_node.includes)
+
+  def get_nodes_to_recompile(self, nodes : List[CompilationGraphSimpleNode], outdate_included_in : bool = True) -> List[CompilationGraphSimpleNode] :
+    """
+    Resolves the outdated nodes to the TUs to recompile, each TU appears once however many outdated headers it includes
+    """
+    nodes_to_recompile = {}
+    for node in nodes:
+      if node.is_up_to_date:
+        continue
+      if not node.is_header:
+        nodes_to_recompile[node] = None
+        continue
+
+      for dependent_node in self.get_dependent_nodes(node):
+        if dependent_node.is_header:
+          dependent_node.is_up_to_date = True
+          continue
+        if outdate_included_in:
+          dependent_node.is_up_to_date = False
+        if not dependent_node.is_up_to_date:
+          nodes_to_recompile[dependent_node] = None
+      node.is_up_to_date = True
+
+    # Importers are compiled against the BMI of the recompiled module units
+    for node in list(nodes_to_recompile):
+      for dependent_node in self.get_module_dependent_nodes(node):
+        dependent_node.is_up_to_date = False
+        nodes_to_recompile[dependent_node] = None
+
+    return list(nodes_to_recompile)
+
+  def get_module_provider(self, module_name : str) -> Union[CompilationGraphSimpleNode, None] :
+    with self._nodes_lock:
+      return self._module_providers.get(module_name, None)
+
+  def get_module_dependent_nodes(self, node : CompilationGraphSimpleNode) -> List[CompilationGraphSimpleNode] :
+    """
+    Returns every node importing the module provided by node, directly or through other modules
+    """
+    if node.module_name is None:
+      return []
+
+    closure = {}
+    visited_module_names = set()
+    module_names_to_visit = [node.module_name]
+    while len(module_names_to_visit):
+      module_name = module_names_to_visit.pop()
+      if module_name in visited_module_names:
+        continue
+      visited_module_names.add(module_name)
+      with self._nodes_lock:
+        importers = list(self._module_importers.get(module_name, ()))
+      for importer in importers:
+        if not importer in closure and not importer is node:
+          closure[importer] = None
+          if not importer.module_name is None:
+            module_names_to_visit.append(importer.module_name)
+    return list(closure)
+
+  def _set_node_modules(self, node : CompilationGraphSimpleNode, module_name : Union[str, None], imported_modules : Sequence[str]) -> None :
+    with self._nodes_lock:
+      if not node.module_name is None and self._module_providers.get(node.module_name, None) is node:
+        del self._module_providers[node.module_name]
+      for imported_module in node.imported_modules:
+        importers = self._module_importers.get(imported_module, {})
+        importers.pop(node, None)
+        if not len(importers):
+          self._module_importers.pop(imported_module, None)
+      node.module_name = module_name
+      node.imported_modules = imported_modules
+      for imported_module in imported_modules:
+        self._module_importers.setdefault(imported_module, {})[node] = None
+      if not module_name is None:
+        self._module_providers[module_name] = node
+
+  def _submit_nodes(self, nodes : List[CompilationGraphSimpleNode]) -> None :
+    for node in nodes:
+      self._weighted_lock.acquire(node.key)
+      self._cpp.create_object_file_dir(node.key)
+    self._compilation_scheduler.submit_all(nodes)
+
   def get_all_sub_nodes(self, key_prefix : str) -> List[CompilationGraphSimpleNode] :
     return list(filter(lambda n : n.key.startswith(key_prefix), self.get_all_nodes()))
 
@@ -154,15 +405,18 @@ class CompilationGraph:
 
   def _visit_node(self, node : CompilationGraphSimpleNode, disable_enqueue : bool = False) -> CompilationGraphSimpleNode :
     links = self._cpp.get_source_includes(node.key)    
+    link_nodes = []
 
     for l in links:
       if self._cpp.is_external_include(l):
         continue
       
-      link_node = self.get_node(l) or self.insert_node(l, disable_enqueue)
+      link_nodes.append(self.get_node(l) or self.insert_node(l, disable_enqueue))
 
-      link_node.included_in.add(node)
-      node.includes.add(link_node)
+    node.add_includes(link_nodes)
+
+    if not node.is_header:
+      self._set_node_modules(node, *self._cpp.get_source_modules(node.key))
 
     self._visited.add(node.key)
 
@@ -176,10 +430,14 @@ class CompilationGraph:
 
     self._visit_node(new_node, disable_enqueue)
 
-    if new_node.is_header:
+    # While the graph is initialized every file gets visited anyway, only later insertions can resolve includes of existing nodes
+    if new_node.is_header and self._is_initialized:
       for node in self.get_all_nodes():
         self.update_node(node.key, disable_enqueue)
 
+    if not new_node.is_header:
+      self._outdate_targets(new_node)
+
     if not disable_enqueue and not new_node.is_header and not self._cpp.is_compiled(key):
       self._compilation_queue.enqueue(new_node)
     
@@ -191,7 +449,7 @@ class CompilationGraph:
     
     updated_node = self.get_node(key)
     
-    updated_node.includes.clear()
+    updated_node.clear_includes()
     self._visit_node(updated_node, disable_enqueue)
     
     updated_node.is_up_to_date = False
@@ -207,30 +465,38 @@ class CompilationGraph:
 
     removed_node = self.get_node(key)
 
-    for includes in removed_node.includes:
-      includes.included_in.discard(removed_node)
+    for includes in list(removed_node.includes):
+      removed_node.remove_include(includes)
 
-    for included_in in removed_node.included_in:
-      included_in.includes.discard(removed_node)
+    for included_in in list(removed_node.included_in):
+      included_in.remove_include(removed_node)
     
+    self._set_node_modules(removed_node, None, ())
+    self._cpp.forget_source_modules(key)
+
     self._compilation_queue.remove(removed_node)
+    self._compilation_scheduler.cancel(removed_node)
     self._weighted_lock.release(key)
 
+    if not removed_node.is_header:
+      self._outdate_targets(removed_node)
+
     with self._nodes_lock:
       del self._nodes[key]
   
   def move_node(self, old_key : str, new_key : str) -> CompilationGraphSimpleNode :
     removed_node = self.get_node(old_key)
-    old_included_in_node = set() 
+    old_included_in_node = EMPTY_INCLUDED_IN
     if removed_node:
-      old_included_in_node = removed_node.included_in.copy()
+      old_included_in_node = set(removed_node.included_in)
       self.remove_node(old_key)
+      self._compilation_history.move(old_key, new_key)
 
     moved_node = self.get_node(new_key) or self.insert_node(new_key, True)
 
     for node in old_included_in_node:
       if self.has_node(node.key):
-        moved_node.included_in.add(node)
+        node.add_includes([moved_node])
 
     moved_node.is_up_to_date = False
     self._compilation_queue.enqueue(moved_node)
@@ -242,24 +508,38 @@ class CompilationGraph:
       self._compilation_queue.enqueue(node)
       node.is_up_to_date = False
   
-  def _on_link_success(self) -> None : 
-    self._logger.info(f"target {self._options['TARGET']} relinked")
+  def _outdate_targets(self, node : CompilationGraphSimpleNode) -> None :
+    for target in self._targets:
+      if target.has_node(node):
+        target.is_up_to_date = False
+
+  def _on_link_success(self, target : CompilationGraphTarget) -> None : 
+    self._logger.info(f"target {target.key} relinked")
     if not self._on_build_graph_success is None:
-      self._on_build_graph_success()
+      self._on_build_graph_success(target)
   
-  def _on_link_error(self) -> None :
-    self._logger.error(f"target {self._options['TARGET']} linking error")
+  def _on_link_error(self, target : CompilationGraphTarget) -> None :
+    self._logger.error(f"target {target.key} linking error")
 
 
-  def _link_target(self) -> None :
+  def link_outdated_targets(self) -> None :
     if self._weighted_lock.is_fully_released() and self._compilation_queue.is_empty():
-      command = self._cpp.get_link_command(list(map(lambda n: n.object_file_path, self.get_all_non_header_nodes())))
-      self._link_process.terminate()
-      self._link_process.run_with_command(command)
+      for target in self._targets:
+        if not target.is_up_to_date:
+          target.link()
+
+  def link(self) -> None :
+    """
+    Relinks outdated targets, up to date targets are directly reported as successfully built
+    """
+    for target in self._targets:
+      if target.is_up_to_date:
+        if not self._on_build_graph_success is None:
+          self._on_build_graph_success(target)
+      else:
+        target.link()
 
   def build(self, outdate_included_in : bool = True) -> bool:
-    rebuild = False
-    for node in self._compilation_queue.consume_queue():
-      node.recompile(outdate_included_in)
-      rebuild = True
-    return rebuild
+    outdated_nodes = self._compilation_queue.consume_queue()
+    self._submit_nodes(self.get_nodes_to_recompile(outdated_nodes, outdate_included_in))
+    return len(outdated_nodes) > 0
@@ -0,0 +1,114 @@
+from json import load, dump, JSONDecodeError
+from os import replace
+from threading import Lock
+from time import time
+from typing import Dict, List, TypedDict, Union
+
+class CompilationHistoryEntry (TypedDict):
+  PEAK_RSS: int
+  DURATION: float
+
+def get_available_memory() -> Union[int, None] :
+  """
+  Returns MemAvailable from /proc/meminfo in bytes, None when it can not be read
+  """
+  try:
+    with open("/proc/meminfo", "r") as fd:
+      for line in fd:
+        if line.startswith("MemAvailable:"):
+          return int(line.split()[1]) * 1024
+  except (OSError, ValueError, IndexError):
+    pass
+  return None
+
+class CompilationHistory:
+  """
+  Peak RSS and duration of the last successful compilation of each TU, and the time of the recent edits of each file, persisted between schr runs
+  """
+
+  # Edits older than this are forgotten, so that edit rates follow the current work
+  EDIT_WINDOW = 30 * 24 * 3600
+  # Editors saving by truncating then writing a file trigger two modifications, edits closer than this count as one
+  EDIT_DEBOUNCE = 1.0
+
+  _entries : Dict[str, CompilationHistoryEntry]
+  _edits : Dict[str, List[float]]
+
+  def __init__(self, compilation_history_file_path : str):
+    self._compilation_history_file_path = compilation_history_file_path
+    self._lock = Lock()
+    self._is_dirty = False
+    self._entries = {}
+    self._edits = {}
+
+    try:
+      with open(self._compilation_history_file_path, "r") as fd:
+        raw_entries = load(fd)
+      edited_after = time() - self.EDIT_WINDOW
+      for key, entry in raw_entries.items():
+        if "peak_rss" in entry:
+          self._entries[key] = {"PEAK_RSS": int(entry["peak_rss"]), "DURATION": float(entry["duration"])}
+        if len(edits := [float(edited_at) for edited_at in entry.get("edits", []) if float(edited_at) >= edited_after]):
+          self._edits[key] = edits
+    except (OSError, JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+      self._entries = {}
+      self._edits = {}
+
+  def get(self, key : str) -> Union[CompilationHistoryEntry, None] :
+    with self._lock:
+      return self._entries.get(key, None)
+
+  def get_all(self) -> Dict[str, CompilationHistoryEntry] :
+    with self._lock:
+      return dict(self._entries)
+
+  def get_max_peak_rss(self) -> int :
+    with self._lock:
+      return max((entry["PEAK_RSS"] for entry in self._entries.values()), default=0)
+
+  def record(self, key : str, peak_rss : int, duration : float) -> None :
+    with self._lock:
+      self._entries[key] = {"PEAK_RSS": peak_rss, "DURATION": duration}
+      self._is_dirty = True
+
+  def record_edit(self, key : str) -> None :
+    edited_at = time()
+    with self._lock:
+      edits = self._edits.get(key, [])
+      if len(edits) and edited_at - edits[-1] < self.EDIT_DEBOUNCE:
+        return
+      self._edits[key] = [e for e in edits if e >= edited_at - self.EDIT_WINDOW] + [edited_at]
+      self._is_dirty = True
+
+  def get_all_edits(self) -> Dict[str, List[float]] :
+    with self._lock:
+      return {key: list(edits) for key, edits in self._edits.items()}
+
+  def move(self, old_key : str, new_key : str) -> None :
+    with self._lock:
+      if old_key in self._entries:
+        self._entries[new_key] = self._entries.pop(old_key)
+        self._is_dirty = True
+      if old_key in self._edits:
+        self._edits[new_key] = self._edits.pop(old_key)
+        self._is_dirty = True
+
+  def write(self) -> None :
+    with self._lock:
+      if not self._is_dirty:
+        return
+      raw_entries = {}
+      for key in sorted(self._entries.keys() | self._edits.keys()):
+        raw_entry = {}
+        if key in self._entries:
+          raw_entry["peak_rss"] = self._entries[key]["PEAK_RSS"]
+          raw_entry["duration"] = round(self._entries[key]["DURATION"], 3)
+        if key in self._edits:
+          raw_entry["edits"] = [round(edited_at, 1) for edited_at in self._edits[key]]
+        raw_entries[key] = raw_entry
+      self._is_dirty = False
+
+    tmp_path = f"{self._compilation_history_file_path}.tmp"
+    with open(tmp_path, "w") as fd:
+      dump(raw_entries, fd, indent=2)
+    replace(tmp_path, self._compilation_history_file_path)
@@ -0,0 +1,286 @@
+from __future__ import annotations
+from collections import OrderedDict
+from os import cpu_count
+from subprocess import run, PIPE
+from threading import Thread, Condition
+from time import sleep
+from typing import Callable, Dict, List, Tuple, Union, TYPE_CHECKING
+
+from .compilation_history import CompilationHistory, get_available_memory
+from ..distributed.compile_client import CompileClient, CompileWorkerStatus
+from ..distributed.protocol import get_worker_token
+from ..multithreading.async_process import AsyncProcess
+from ..utils.cpp import CppUtils
+from ..utils.logger import Logger
+
+if TYPE_CHECKING:
+  from .compilation_graph import CompilationGraphSimpleNode
+
+class CompilationSchedulerJob:
+
+  process : Union[AsyncProcess, None] = None
+
+  def __init__(self, node : CompilationGraphSimpleNode, generation : int):
+    self.node = node
+    self.generation = generation
+    # BMIs of imported modules only exist on this machine
+    self.local_only = not node.module_name is None or len(node.imported_modules) > 0
+    self.diagnostics = []
+    # Memory reserved from the local budget while the job runs on a local slot
+    self.reserved_memory = 0
+
+  def log_diagnostic(self, line : str) -> None :
+    print(line)
+    self.diagnostics.append(line)
+
+class CompilationScheduler:
+  """
+  Runs compilations on a bounded number of local slots and, when configured, on remote schr-worker slots.
+  Local compilations are also admitted against a memory budget using the peak RSS of their previous compilation.
+  Resubmitting a node cancels its ongoing compilation, only the latest submission reports its result.
+  """
+
+  # Share of the available memory used as budget when none is configured
+  MEMORY_BUDGET_RATIO = 0.8
+
+  _pending : OrderedDict[str, CompilationSchedulerJob]
+  _running : Dict[str, CompilationSchedulerJob]
+  _generations : Dict[str, int]
+
+  def __init__(self, cpp : CppUtils, logger : Logger, jobs : int, workers : List[str], memory_budget : int, compilation_history : CompilationHistory, on_success : Callable[[CompilationGraphSimpleNode], None], on_error : Callable[[CompilationGraphSimpleNode], None]):
+    self._cpp = cpp
+    self._logger = logger
+    self._compilation_history = compilation_history
+    self._on_success = on_success
+    self._on_error = on_error
+
+    self._pending = OrderedDict()
+    self._running = {}
+    self._generations = {}
+    self._condition = Condition()
+
+    self._jobs = max(jobs or cpu_count() or 1, 1)
+    if memory_budget <= 0 and (available_memory := get_available_memory()) is not None:
+      memory_budget = int(available_memory * self.MEMORY_BUDGET_RATIO)
+    self._memory_budget = memory_budget
+    self._reserved_memory = 0
+    if self._memory_budget > 0:
+      self._logger.info(f"local compilations limited to {self._memory_budget >> 20} MiB")
+
+    for _ in range(self._jobs):
+      Thread(target=self._run_local_slot, daemon=True).start()
+
+    for address in workers:
+      worker_status = CompileWorkerStatus(address)
+      try:
+        client = CompileClient(address, get_worker_token())
+        slots = client.get_slots()
+        client.close()
+        self._logger.info(f"worker {address} connected with {slots} slots")
+      except ConnectionError as e:
+        slots = 1
+        worker_status.mark_as_down()
+        self._logger.warn(str(e))
+      for _ in range(slots):
+        Thread(target=self._run_remote_slot, args=(worker_status,), daemon=True).start()
+
+  def submit(self, node : CompilationGraphSimpleNode) -> None :
+    self.submit_all([node])
+
+  def submit_all(self, nodes : List[CompilationGraphSimpleNode]) -> None :
+    """
+    Submits nodes at once, so that no slot takes a module importer before the node providing its module is pending
+    """
+    running_jobs = []
+    with self._condition:
+      for node in nodes:
+        generation = self._generations.get(node.key, 0) + 1
+        self._generations[node.key] = generation
+        self._pending.pop(node.key, None)
+        self._pending[node.key] = CompilationSchedulerJob(node, generation)
+        if node.key in self._running:
+          running_jobs.append(self._running[node.key])
+      cyclic_jobs = self._take_module_cycles() if any(len(node.imported_modules) for node in nodes) else []
+      self._condition.notify_all()
+
+    for running_job in running_jobs:
+      if not running_job.process is None:
+        running_job.process.terminate()
+
+    for cyclic_job, cycle in cyclic_jobs:
+      cyclic_job.log_diagnostic(f"{cyclic_job.node.key}: error: module import cycle {cycle}")
+      cyclic_job.node.diagnostics = cyclic_job.diagnostics
+      self._on_error(cyclic_job.node)
+
+  def cancel(self, node : CompilationGraphSimpleNode) -> None :
+    with self._condition:
+      self._generations[node.key] = self._generations.get(node.key, 0) + 1
+      self._pending.pop(node.key, None)
+      running_job = self._running.get(node.key, None)
+
+    if not running_job is None and not running_job.process is None:
+      running_job.process.terminate()
+
+  def is_idle(self) -> bool :
+    with self._condition:
+      return len(self._pending) == 0 and len(self._running) == 0
+
+  def get_memory_estimate(self, node : CompilationGraphSimpleNode) -> int :
+    """
+    Peak RSS of the last compilation of node, TUs never compiled are expected to be as heavy as the heaviest known TU
+    """
+    entry = self._compilation_history.get(node.key)
+    if not entry is None:
+      return entry["PEAK_RSS"]
+    return max(self._compilation_history.get_max_peak_rss(), self._memory_budget // self._jobs)
+
+  def _is_waiting_for_modules(self, job : CompilationSchedulerJob) -> bool :
+    if not len(job.node.imported_modules):
+      return False
+    return any(provider.key in self._pending or provider.key in self._running for provider in job.node.get_module_dependencies())
+
+  def _get_pending_module_dependencies(self, key : str) -> List[str] :
+    return [provider.key for provider in self._pending[key].node.get_module_dependencies() if provider.key in self._pending]
+
+  def _take_module_cycles(self) -> List[Tuple[CompilationSchedulerJob, str]] :
+    """
+    Removes the pending jobs whose modules import each other, since each one would wait for the others forever.
+    Returns them with their cycle, must be called with the condition held
+    """
+    cycles : Dict[str, List[str]] = {}
+    visited_keys = set()
+    for root_key in self._pending:
+      if root_key in visited_keys:
+        continue
+      # Iterative depth first search, path holds the keys being visited
+      path = [root_key]
+      dependencies_to_visit = [iter(self._get_pending_module_dependencies(root_key))]
+      visited_keys.add(root_key)
+      while len(path):
+        dependency_key = next(dependencies_to_visit[-1], None)
+        if dependency_key is None:
+          path.pop()
+          dependencies_to_visit.pop()
+        elif dependency_key in path:
+          cycle = path[path.index(dependency_key):] + [dependency_key]
+          for key in cycle:
+            cycles.setdefault(key, cycle)
+        elif not dependency_key in visited_keys:
+          visited_keys.add(dependency_key)
+          path.append(dependency_key)
+          dependencies_to_visit.append(iter(self._get_pending_module_dependencies(dependency_key)))
+
+    cyclic_jobs = []
+    for key, cycle in cycles.items():
+      cyclic_jobs.append((self._pending[key], " -> ".join(self._pending[k].node.module_name or k for k in cycle)))
+    for key in cycles:
+      del self._pending[key]
+    return cyclic_jobs
+
+  def _take_job(self, local : bool) -> CompilationSchedulerJob :
+    with self._condition:
+      while True:
+        for key, job in self._pending.items():
+          if key in self._running or (job.local_only and not local) or self._is_waiting_for_modules(job):
+            continue
+          if local and self._memory_budget > 0:
+            memory_estimate = self.get_memory_estimate(job.node)
+            # A job above the whole budget still runs, alone
+            if self._reserved_memory > 0 and self._reserved_memory + memory_estimate > self._memory_budget:
+              continue
+            job.reserved_memory = memory_estimate
+            self._reserved_memory += memory_estimate
+          del self._pending[key]
+          self._running[key] = job
+          return job
+        self._condition.wait()
+
+  def _complete_job(self, job : CompilationSchedulerJob, success : bool) -> None :
+    with self._condition:
+      del self._running[job.node.key]
+      self._reserved_memory -= job.reserved_memory
+      job.reserved_memory = 0
+      is_current = self._generations.get(job.node.key, 0) == job.generation
+      is_idle = len(self._pending) == 0 and len(self._running) == 0
+      self._condition.notify_all()
+
+    if is_current:
+      job.node.diagnostics = job.diagnostics
+      if success:
+        self._on_success(job.node)
+      else:
+        self._on_error(job.node)
+
+    if is_idle:
+      try:
+        self._compilation_history.write()
+      except OSError as e:
+        self._logger.warn(f"could not write compilation history: {e}")
+
+  def _requeue_as_local(self, job : CompilationSchedulerJob) -> None :
+    with self._condition:
+      del self._running[job.node.key]
+      if self._generations.get(job.node.key, 0) == job.generation and not job.node.key in self._pending:
+        job.local_only = True
+        job.diagnostics = []
+        self._pending[job.node.key] = job
+        self._pending.move_to_end(job.node.key, last=False)
+      self._condition.notify_all()
+
+  def _run_local_slot(self) -> None :
+    while True:
+      job = self._take_job(True)
+      job.process = AsyncProcess(self._cpp.get_compile_command(job.node.key), {"stderr_logger": job.log_diagnostic})
+      job.process.run()
+      exit_code = job.process.wait()
+      if exit_code == 0 and not job.process.peak_rss is None:
+        self._compilation_history.record(job.node.key, job.process.peak_rss, job.process.duration)
+      job.process = None
+      self._complete_job(job, exit_code == 0)
+
+  def _run_remote_slot(self, worker_status : CompileWorkerStatus) -> None :
+    client = CompileClient(worker_status.address, get_worker_token())
+    while True:
+      if not worker_status.is_available():
+        sleep(1)
+        continue
+
+      job = self._take_job(False)
+
+      preprocessing = run(self._cpp.get_preprocess_command(job.node.key), stdout=PIPE, stderr=PIPE)
+      if preprocessing.returncode != 0:
+        # Let a local slot report the diagnostics
+        self._requeue_as_local(job)
+        continue
+
+      try:
+        response, object_file = client.compile(job.node.key, self._cpp.get_compiler(job.node.key), self._cpp.get_remote_compile_flags(job.node.key), self._cpp.get_source_language(job.node.key), preprocessing.stdout)
+      except ConnectionError as e:
+        self._logger.warn(f"{e}, compiling {job.node.key} locally")
+        worker_status.mark_as_down()
+        self._requeue_as_local(job)
+        continue
+
+      if response.get("status") == "rejected":
+        self._logger.warn(f"worker {worker_status.address} rejected {job.node.key}: {response.get('stderr', '')}")
+        worker_status.mark_as_down()
+        self._requeue_as_local(job)
+        continue
+
+      for line in response.get("stderr", "").splitlines():
+        job.log_diagnostic(line)
+
+      success = response.get("status") == "ok"
+      if success:
+        with self._condition:
+          is_current = self._generations.get(job.node.key, 0) == job.generation
+        if is_current:
+          try:
+            with open(job.node.object_file_path, "wb") as fd:
+              fd.write(object_file)
+          except OSError as e:
+            # e.g. the disk is full or the object directory was removed
+            job.log_diagnostic(f"{job.node.object_file_path}: {e}")
+            success = False
+
+      self._complete_job(job, success)
@@ -0,0 +1,46 @@
+from re import MULTILINE, DOTALL, compile as compile_regex
+from typing import Tuple, Union
+
+COMMENT_REGEX = compile_regex(r"//[^\n]*|/\*.*?\*/", DOTALL)
+MODULE_DECLARATION_REGEX = compile_regex(r"^\s*(?:export\s+)?module\s+([\w.]+(?::[\w.]+)?)\s*(?:\[\[.*?\]\]\s*)?;", MULTILINE)
+MODULE_IMPORT_REGEX = compile_regex(r"^\s*(?:export\s+)?import\s+([\w.]*(?::[\w.]+)?)\s*(?:\[\[.*?\]\]\s*)?;", MULTILINE)
+
+SourceModules = Tuple[Union[str, None], Tuple[str, ...]]
+
+NO_SOURCE_MODULES : SourceModules = (None, ())
+
+def scan_source_modules(cpp_source_path : str) -> SourceModules :
+  """
+  Returns the module provided by a C++20 module unit (None for implementation units and non module files) and the modules it imports,
+  partitions are returned with their primary module name (e.g. "m:part"), header units are ignored
+  """
+  try:
+    with open(cpp_source_path, "r", errors="replace") as fd:
+      source = fd.read()
+  except OSError:
+    return NO_SOURCE_MODULES
+
+  if not "module" in source and not "import" in source:
+    return NO_SOURCE_MODULES
+
+  source = COMMENT_REGEX.sub("", source)
+
+  declaration = MODULE_DECLARATION_REGEX.search(source)
+  declared_module = None if declaration is None else declaration.group(1)
+  primary_module = None if declared_module is None else declared_module.partition(":")[0]
+
+  imported_modules = []
+  if not declared_module is None and not ":" in declared_module and not declaration.group(0).lstrip().startswith("export"):
+    # Implementation units implicitly import their primary module interface
+    imported_modules.append(declared_module)
+    declared_module = None
+
+  for imported_module in MODULE_IMPORT_REGEX.findall(source):
+    if imported_module.startswith(":"):
+      if primary_module is None:
+        continue
+      imported_module = f"{primary_module}{imported_module}"
+    if not imported_module in imported_modules and imported_module != declared_module:
+      imported_modules.append(imported_module)
+
+  return declared_module, tuple(imported_modules)
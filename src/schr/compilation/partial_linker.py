@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from os import makedirs, remove, replace
+from os.path import basename, dirname, exists, getmtime, join
+from subprocess import run, PIPE
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from ..utils.cpp import CppUtils
+from ..utils.logger import Logger
+
+class PartialLinker:
+  """
+  Partially links (-r) the objects of each directory of a target into a cached relocatable object, so that the final link only takes a few inputs.
+  A group is relinked only when one of its objects is newer than it, and its file name holds a digest of its objects so that adding or removing a TU makes a new group
+  """
+
+  # Smaller groups are passed as is to the final link
+  MIN_GROUP_SIZE = 2
+
+  _group_locks : Dict[str, Lock]
+  _target_group_paths : Dict[str, Set[str]]
+
+  def __init__(self, cpp : CppUtils, logger : Logger, jobs : int):
+    self._cpp = cpp
+    self._logger = logger
+    self._executor = ThreadPoolExecutor(max_workers=max(jobs, 1))
+    self._lock = Lock()
+    self._group_locks = {}
+    self._target_group_paths = {}
+
+  def get_groups(self, object_file_paths : List[str]) -> Dict[str, List[str]] :
+    groups = {}
+    for object_file_path in object_file_paths:
+      groups.setdefault(dirname(object_file_path), []).append(object_file_path)
+    return {group_dir: sorted(group) for group_dir, group in groups.items()}
+
+  def _get_group_lock(self, group_path : str) -> Lock :
+    # Targets sharing the same objects of a directory share the group
+    with self._lock:
+      if not group_path in self._group_locks:
+        self._group_locks[group_path] = Lock()
+      return self._group_locks[group_path]
+
+  def _is_group_up_to_date(self, group_path : str, object_file_paths : List[str]) -> bool :
+    if not exists(group_path):
+      return False
+    group_mtime = getmtime(group_path)
+    return all(exists(o) and getmtime(o) < group_mtime for o in object_file_paths)
+
+  def _link_group(self, group_dir : str, group_path : str, object_file_paths : List[str], log_diagnostic : Callable[[str], None]) -> bool :
+    with self._get_group_lock(group_path):
+      started_at = perf_counter()
+      try:
+        if self._is_group_up_to_date(group_path, object_file_paths):
+          return True
+
+        makedirs(dirname(group_path), exist_ok=True)
+        tmp_group_path = f"{group_path}.tmp"
+        result = run(self._cpp.get_partial_link_command(object_file_paths, tmp_group_path), stdout=PIPE, stderr=PIPE, text=True)
+        for line in result.stderr.splitlines():
+          log_diagnostic(line)
+        if result.returncode != 0:
+          self._logger.error(f"{group_dir} partial link error")
+          return False
+
+        replace(tmp_group_path, group_path)
+      except OSError as e:
+        # e.g. the compiler is missing or an object was removed meanwhile
+        log_diagnostic(f"{group_dir}: {e}")
+        self._logger.error(f"{group_dir} partial link error")
+        return False
+
+      self._logger.info(f"{group_dir} partially linked ({len(object_file_paths)} objects in {perf_counter() - started_at:.2f}s)")
+      return True
+
+  def _forget_stale_groups(self, target_key : str, group_paths : Set[str]) -> None :
+    """
+    Removes the groups of the same directories left by previous memberships, unless a target registered them since schr started
+    """
+    with self._lock:
+      self._target_group_paths[target_key] = group_paths
+      used_group_paths = set().union(*self._target_group_paths.values())
+      stale_group_paths = [
+        p
+        for group_path in group_paths
+        for p in glob(join(dirname(group_path), f"{basename(group_path).split('.')[0]}.*.o"))
+        if not p in used_group_paths
+      ]
+
+    for stale_group_path in stale_group_paths:
+      try:
+        remove(stale_group_path)
+      except OSError:
+        pass
+
+  def link_groups(self, target_key : str, object_file_paths : List[str], log_diagnostic : Callable[[str], None]) -> Union[List[str], None] :
+    """
+    Relinks the outdated groups of a target in parallel, returns the inputs of its final link or None when a group could not be linked
+    """
+    link_inputs = []
+    groups : List[Tuple[str, str, List[str]]] = []
+    for group_dir, group in self.get_groups(object_file_paths).items():
+      if len(group) < self.MIN_GROUP_SIZE:
+        link_inputs.extend(group)
+        continue
+      group_path = self._cpp.get_partial_link_file_path(group_dir, group)
+      groups.append((group_dir, group_path, group))
+      link_inputs.append(group_path)
+
+    group_paths = {group_path for _, group_path, _ in groups}
+    with self._lock:
+      # Registered before linking and kept on failure, so that the cleanup of another target sharing a directory never removes a group being linked
+      self._target_group_paths[target_key] = self._target_group_paths.get(target_key, set()) | group_paths
+
+    results = list(self._executor.map(lambda g: self._link_group(*g, log_diagnostic), groups))
+    if not all(results):
+      return None
+
+    self._forget_stale_groups(target_key, group_paths)
+    return link_inputs
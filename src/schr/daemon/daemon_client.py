@@ -0,0 +1,22 @@
+from json import dumps, loads
+from socket import socket, AF_UNIX, SOCK_STREAM
+from typing import Dict, Union
+
+class DaemonClient:
+
+  def __init__(self, socket_path : str, timeout : Union[float, None] = None):
+    self._socket_path = socket_path
+    self._timeout = timeout
+
+  def request(self, command : str, **arguments) -> Dict :
+    with socket(AF_UNIX, SOCK_STREAM) as sock:
+      sock.settimeout(self._timeout)
+      sock.connect(self._socket_path)
+      sock.sendall(dumps({"command": command, **arguments}).encode() + b"\n")
+      with sock.makefile("rb") as sock_file:
+        raw_response = sock_file.readline()
+
+    if not raw_response:
+      raise ConnectionError(f"DaemonClient.request: no response from {self._socket_path}")
+
+    return loads(raw_response)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+from errno import EADDRINUSE
+from json import dumps, loads
+from os import remove
+from socket import socket, AF_UNIX, SOCK_STREAM
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Thread
+from typing import Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+  from ..hot_reloader import HotReloader
+
+class DaemonRequestHandler(StreamRequestHandler):
+
+  server : DaemonServer
+
+  def handle(self) -> None :
+    for raw_request in self.rfile:
+      try:
+        request = loads(raw_request)
+        if not isinstance(request, dict):
+          raise ValueError("expected a json object")
+        response = self._dispatch(request)
+      except ValueError as e:
+        response = {"status": "error", "error": f"invalid request: {e}"}
+
+      self.wfile.write(dumps(response).encode() + b"\n")
+      self.wfile.flush()
+
+  def _dispatch(self, request : Dict) -> Dict :
+    hot_reloader = self.server.hot_reloader
+    command = request.get("command")
+
+    if command == "status":
+      return {"status": "ok", **hot_reloader.get_status()}
+    if command == "build":
+      return {"status": "ok", "started": hot_reloader.build_now()}
+    if command == "wait":
+      timeout = request.get("timeout", None)
+      if not timeout is None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout < 0):
+        return {"status": "error", "error": f"invalid timeout {dumps(timeout)}, expected a non-negative number of seconds"}
+      target = hot_reloader.wait_for_link_success(timeout)
+      if target is None:
+        return {"status": "timeout"}
+      return {"status": "ok", "target": target}
+    if command == "dirty":
+      return {"status": "ok", "nodes": hot_reloader.get_dirty_nodes()}
+    if command == "diagnostics":
+      return {"status": "ok", **hot_reloader.get_diagnostics()}
+
+    return {"status": "error", "error": f"unknown command {command}, expected one of status, build, wait, dirty, diagnostics"}
+
+class DaemonServer(ThreadingUnixStreamServer):
+  """
+  Json lines API over a unix domain socket, each request is a json object with a "command" key and gets a json object as response
+  """
+
+  daemon_threads = True
+
+  def __init__(self, socket_path : str, hot_reloader : HotReloader):
+    self.socket_path = socket_path
+    self.hot_reloader = hot_reloader
+
+    # The socket of a daemon that did not stop cleanly is left behind, only a socket nobody listens on is removed
+    with socket(AF_UNIX, SOCK_STREAM) as sock:
+      try:
+        sock.connect(socket_path)
+      except ConnectionRefusedError:
+        remove(socket_path)
+      except FileNotFoundError:
+        pass
+      else:
+        raise OSError(EADDRINUSE, f"a schr daemon is already listening on {socket_path}")
+
+    super().__init__(socket_path, DaemonRequestHandler)
+
+  def start(self) -> None :
+    Thread(target=self.serve_forever, daemon=True).start()
+
+  def stop(self) -> None :
+    self.shutdown()
+    self.server_close()
+    try:
+      remove(self.socket_path)
+    except OSError:
+      pass
@@ -0,0 +1,88 @@
+from socket import create_connection, socket, IPPROTO_TCP, SOL_SOCKET, SO_KEEPALIVE
+from threading import Lock
+from time import monotonic
+from typing import BinaryIO, List, Tuple, Union
+
+from .protocol import send_message, recv_message
+
+# Reads have no timeout by default, keepalive probes detect the workers that went away in the middle of a compilation
+try:
+  from socket import TCP_KEEPIDLE, TCP_KEEPINTVL, TCP_KEEPCNT
+  KEEPALIVE_OPTIONS = [(TCP_KEEPIDLE, 30), (TCP_KEEPINTVL, 10), (TCP_KEEPCNT, 3)]
+except ImportError:
+  KEEPALIVE_OPTIONS = []
+
+class CompileClient:
+  """
+  Connection to a schr-worker, a client must not be shared between threads
+  """
+
+  RETRY_DELAY = 30
+
+  _socket : Union[socket, None] = None
+  _socket_file : Union[BinaryIO, None] = None
+
+  def __init__(self, address : str, token : str, connect_timeout : float = 10, timeout : Union[float, None] = None):
+    host, _, port = address.rpartition(":")
+    self.address = address
+    self._host = host
+    self._port = int(port)
+    self._token = token
+    self._connect_timeout = connect_timeout
+    self._timeout = timeout
+
+  def _connect(self) -> None :
+    if self._socket is None:
+      self._socket = create_connection((self._host, self._port), timeout=self._connect_timeout)
+      self._socket.settimeout(self._timeout)
+      self._socket.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+      for option, value in KEEPALIVE_OPTIONS:
+        self._socket.setsockopt(IPPROTO_TCP, option, value)
+      self._socket_file = self._socket.makefile("rb")
+
+  def close(self) -> None :
+    if not self._socket is None:
+      try:
+        self._socket_file.close()
+        self._socket.close()
+      except OSError:
+        pass
+    self._socket = None
+    self._socket_file = None
+
+  def request(self, header : dict, payload : bytes = b"") -> Tuple[dict, bytes] :
+    try:
+      self._connect()
+      send_message(self._socket, {**header, "token": self._token}, payload)
+      return recv_message(self._socket_file)
+    except (OSError, ValueError) as e:
+      self.close()
+      raise ConnectionError(f"worker {self.address} unreachable: {e}")
+
+  def get_slots(self) -> int :
+    header, _ = self.request({"command": "info"})
+    if header.get("status") != "ok":
+      self.close()
+      raise ConnectionError(f"worker {self.address} refused the connection: {header.get('stderr', '')}")
+    return int(header.get("slots", 1))
+
+  def compile(self, name : str, compiler : str, flags : List[str], language : str, preprocessed_source : bytes) -> Tuple[dict, bytes] :
+    return self.request({"command": "compile", "name": name, "compiler": compiler, "flags": flags, "language": language}, preprocessed_source)
+
+class CompileWorkerStatus:
+  """
+  Shared availability of a worker between the clients connected to it, a failing worker is skipped for RETRY_DELAY seconds
+  """
+
+  def __init__(self, address : str):
+    self.address = address
+    self._down_until = 0
+    self._lock = Lock()
+
+  def is_available(self) -> bool :
+    with self._lock:
+      return monotonic() >= self._down_until
+
+  def mark_as_down(self) -> None :
+    with self._lock:
+      self._down_until = monotonic() + CompileClient.RETRY_DELAY
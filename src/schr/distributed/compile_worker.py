@@ -0,0 +1,119 @@
+from hmac import compare_digest
+from os import cpu_count, path
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from subprocess import run, PIPE
+from tempfile import TemporaryDirectory
+from threading import BoundedSemaphore
+from typing import List, Union
+
+from .protocol import send_message, recv_header, recv_payload
+from ..utils.logger import Logger
+
+# The source is already preprocessed, so only flags changing the code generation and the diagnostics are needed.
+# Anything else may run programs, load plugins or read and write files of the worker (-wrapper, -B, -specs=, @file, ...)
+SAFE_FLAGS = ["-w", "-pedantic", "-pedantic-errors", "-pthread"]
+SAFE_FLAG_PREFIXES = ["-I", "-D", "-U", "-std=", "-O", "-W", "-f", "-g", "-m"]
+UNSAFE_FLAG_PREFIXES = ["-Wl,", "-Wa,", "-Wp,", "-fplugin", "-fmodule", "-fprebuilt-module-path", "-fprofile", "-fauto-profile", "-fdump", "-fopt-info", "-fsave-optimization-record", "-mllvm"]
+
+def get_unsafe_flag(flags : List[str]) -> Union[str, None] :
+  """
+  Returns the first flag of flags a worker must not run, None when every flag is known to be safe
+  """
+  for flag in flags:
+    if not isinstance(flag, str):
+      return str(flag)
+    if flag in SAFE_FLAGS:
+      continue
+    if not any(flag.startswith(p) for p in SAFE_FLAG_PREFIXES) or any(flag.startswith(p) for p in UNSAFE_FLAG_PREFIXES):
+      return flag
+    # Paths given to -f flags may point anywhere on the worker, only path remappings are harmless
+    if flag.startswith("-f") and "/" in flag.partition("=")[2] and not "-prefix-map=" in flag:
+      return flag
+  return None
+
+class CompileWorkerRequestHandler(StreamRequestHandler):
+
+  server : "CompileWorker"
+
+  def handle(self) -> None :
+    while True:
+      try:
+        header = recv_header(self.rfile)
+      except (ConnectionError, ValueError):
+        return
+
+      # The payload of an unauthenticated peer is never read
+      if not compare_digest(str(header.get("token", "")).encode(), self.server.token.encode()):
+        self.server.logger.warn(f"{self.client_address[0]} sent an invalid token")
+        send_message(self.connection, {"status": "rejected", "stderr": "invalid worker token"})
+        return
+
+      try:
+        payload = recv_payload(self.rfile, header, self.server.max_payload_size)
+      except ValueError as e:
+        send_message(self.connection, {"status": "rejected", "stderr": str(e)})
+        return
+      except ConnectionError:
+        return
+
+      if header.get("command") == "info":
+        send_message(self.connection, {"status": "ok", "slots": self.server.slots})
+      elif header.get("command") == "compile":
+        self._compile(header, payload)
+      else:
+        send_message(self.connection, {"status": "error", "stderr": f"unknown command {header.get('command')}"})
+
+  def _compile(self, header : dict, payload : bytes) -> None :
+    compiler = path.basename(header.get("compiler", ""))
+    if not compiler in self.server.allowed_compilers:
+      send_message(self.connection, {"status": "rejected", "stderr": f"compiler {compiler} is not allowed on this worker"})
+      return
+
+    flags = header.get("flags", [])
+    unsafe_flag = get_unsafe_flag(flags) if isinstance(flags, list) else str(flags)
+    if not unsafe_flag is None:
+      self.server.logger.warn(f"{header.get('name', '?')} rejected, {unsafe_flag} is not allowed")
+      send_message(self.connection, {"status": "rejected", "stderr": f"flag {unsafe_flag} is not allowed on this worker"})
+      return
+
+    with self.server.slots_semaphore, TemporaryDirectory(prefix="schr-worker-") as tmp_dir:
+      object_file_path = path.join(tmp_dir, "out.o")
+      result = run(
+        [compiler, *flags, "-x", f"{header.get('language', 'c++')}-cpp-output", "-c", "-", "-o", object_file_path],
+        input=payload,
+        stdout=PIPE,
+        stderr=PIPE
+      )
+
+      if result.returncode != 0:
+        self.server.logger.warn(f"{header.get('name', '?')} compilation error")
+        send_message(self.connection, {"status": "error", "returncode": result.returncode, "stderr": result.stderr.decode(errors="replace")})
+        return
+
+      with open(object_file_path, "rb") as fd:
+        object_file = fd.read()
+
+    self.server.logger.info(f"{header.get('name', '?')} compiled")
+    send_message(self.connection, {"status": "ok", "returncode": 0, "stderr": result.stderr.decode(errors="replace")}, object_file)
+
+class CompileWorker(ThreadingTCPServer):
+  """
+  Compiles preprocessed translation units sent by schr over TCP and sends back the object files, requests must hold the token the worker was started with
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+  # Largest preprocessed source accepted
+  max_payload_size = 256 << 20
+
+  def __init__(self, host : str, port : int, token : str, slots : int = 0, allowed_compilers : List[str] = ["g++", "gcc", "c++", "cc", "clang", "clang++"]):
+    self.token = token
+    self.slots = slots or cpu_count() or 1
+    self.slots_semaphore = BoundedSemaphore(self.slots)
+    self.allowed_compilers = allowed_compilers
+    self.logger = Logger({"NAME": "schr-worker", "SUCCESS_COLOR": "GREEN", "INFO_COLOR": "BLUE", "WARN_COLOR": "YELLOW", "ERROR_COLOR": "RED"})
+    super().__init__((host, port), CompileWorkerRequestHandler)
+
+  def get_address(self) -> str :
+    host, port = self.server_address[:2]
+    return f"{host}:{port}"
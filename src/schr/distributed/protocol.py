@@ -0,0 +1,46 @@
+from json import dumps, loads
+from os import environ
+from socket import socket
+from typing import BinaryIO, Dict, Tuple, Union
+
+# Each message is a json header on a single line followed by "size" bytes of raw payload (preprocessed source, object file, ...)
+
+# Shared secret of schr and its workers, read from the environment so that it shows up neither in process lists nor in recordings
+WORKER_TOKEN_ENV_VAR = "SCHR_WORKER_TOKEN"
+
+# Headers only hold a few fields and the flags of a compilation
+MAX_HEADER_SIZE = 1 << 20
+
+def get_worker_token() -> str :
+  return environ.get(WORKER_TOKEN_ENV_VAR, "")
+
+def send_message(sock : socket, header : Dict, payload : bytes = b"") -> None :
+  sock.sendall(dumps({**header, "size": len(payload)}).encode() + b"\n" + payload)
+
+def recv_header(sock_file : BinaryIO, max_header_size : int = MAX_HEADER_SIZE) -> Dict :
+  raw_header = sock_file.readline(max_header_size + 1)
+  if not raw_header:
+    raise ConnectionError("recv_header: connection closed by peer")
+  if not raw_header.endswith(b"\n"):
+    raise ValueError("recv_header: header too large or truncated")
+
+  header = loads(raw_header)
+  if not isinstance(header, dict) or not isinstance(header.get("size", 0), int) or header.get("size", 0) < 0:
+    raise ValueError("recv_header: malformed header")
+  return header
+
+def recv_payload(sock_file : BinaryIO, header : Dict, max_payload_size : Union[int, None] = None) -> bytes :
+  """
+  Reads the payload announced by header, a payload above max_payload_size is refused before anything is read
+  """
+  size = header.get("size", 0)
+  if not max_payload_size is None and size > max_payload_size:
+    raise ValueError(f"recv_payload: payload of {size} bytes above the limit of {max_payload_size} bytes")
+  payload = sock_file.read(size)
+  if len(payload) != size:
+    raise ConnectionError("recv_payload: truncated payload")
+  return payload
+
+def recv_message(sock_file : BinaryIO) -> Tuple[Dict, bytes] :
+  header = recv_header(sock_file)
+  return header, recv_payload(sock_file, header)
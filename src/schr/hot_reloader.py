@@ -1,16 +1,24 @@
 from os import path, remove, rmdir, listdir
 from re import match
 from signal import signal, SIGINT
+from threading import Condition
+from typing import Dict, List, Union
 
 from watchdog.events import DirDeletedEvent, DirMovedEvent, FileDeletedEvent, FileMovedEvent, FileSystemEvent, RegexMatchingEventHandler, DirCreatedEvent, DirModifiedEvent, FileCreatedEvent, FileModifiedEvent
 from watchdog.observers import Observer
 
-from .options import SimpleCppHotReloaderOptions
+from .options import SimpleCppHotReloaderOptions, SimpleCppHotReloaderTargetOptions, get_targets
 from .utils.logger import Logger, LoggerOptions
 from .utils.cpp import CppUtils
-from .compilation.compilation_graph import CompilationGraph
+from .compilation.compilation_graph import CompilationGraph, CompilationGraphTarget
+from .compilation.compilation_database import CompilationDatabaseWriter
 from .multithreading.async_process import AsyncProcess
 from .cache.compilation_cache import CompilationCache
+from .cache.build_configurations import BuildConfigurations
+from .daemon.daemon_server import DaemonServer
+from .testing.impacted_test_runner import ImpactedTestRunner
+from .replay.event_recorder import EventRecorder
+from .watching.snapshot_observer import SnapshotObserver
 
 class HotReloader(RegexMatchingEventHandler):
 
@@ -21,39 +29,117 @@ class HotReloader(RegexMatchingEventHandler):
 
     signal(SIGINT, lambda _a, _b: print() or exit(-1))
 
-    self._target_logger = Logger({"NAME": self._options["TARGET"], "SUCCESS_COLOR": "GREEN", "INFO_COLOR": "WHITE", "ERROR_COLOR": "MAGENTA", "WARN_COLOR": "CYAN"})
-    self._target_process = AsyncProcess(
-      self._cpp.get_target_command(),
-      {
-        "name": self._options["TARGET"],
-        "logger": lambda l: self._target_logger.warn(l),
-        "stdout_logger": lambda l: self._target_logger.info(l),
-        "stderr_logger": lambda l: self._target_logger.error(l),
-      }
-    )
+    self._link_success_condition = Condition()
+    self._link_success_count = 0
+    self._last_linked_target : Union[str, None] = None
+    self._daemon_server : Union[DaemonServer, None] = None
+    self._compilation_database_writer : Union[CompilationDatabaseWriter, None] = None
+    self._impacted_test_runner : Union[ImpactedTestRunner, None] = None
+    self._event_recorder : Union[EventRecorder, None] = None
+
+    self._target_processes = {target["TARGET"]: self._create_target_process(target) for target in get_targets(self._options)}
+
+    self._use_build_configuration()
 
     self._logger.info(f"computing include graph of project \"{self._options['WORKING_DIR']}\"")
     self._compilation_graph = CompilationGraph(self._options, self._cpp, self._logger, self._on_compilation_graph_build_success)
     self._logger.success(f"ok")
 
+    if len(self._options["COMPDB_EXPORT"]):
+      self._logger.info(f"exporting compilation database to \"{self._options['COMPDB_EXPORT']}\"")
+      self._compilation_database_writer = CompilationDatabaseWriter(self._options["COMPDB_EXPORT"], self._options["WORKING_DIR"])
+      for node in self._compilation_graph.get_all_non_header_nodes():
+        self._compilation_database_writer.insert(node.key, self._cpp.get_compile_command(node.key))
+      self._compilation_database_writer.write()
+      self._logger.success(f"ok")
+
+    if "T" in self._options["MODE"]:
+      self._impacted_test_runner = ImpactedTestRunner(self._compilation_graph, self._cpp, self._logger)
+
+    if len(self._options["RECORD"]):
+      self._logger.info(f"recording filesystem events to \"{self._options['RECORD']}\"")
+      self._event_recorder = EventRecorder(self._options["RECORD"], self._options, [node.key for node in self._compilation_graph.get_all_nodes()])
+      self._logger.success(f"ok")
+
     self._logger.info(f"initializing cshr cache with \"{self._cpp.get_compilation_cache_file_path()}\"")
-    self._compilation_cache = CompilationCache(self._compilation_graph, self._cpp.get_compilation_cache_file_path())
+    self._compilation_cache = CompilationCache(self._compilation_graph, self._cpp.get_compilation_cache_file_path(), self._cpp.get_build_configuration_key(), self._logger)
     self._logger.success(f"ok")
 
+    for target in self._compilation_graph.get_all_targets():
+      if target.is_up_to_date and not self._build_configurations.is_linked_with(target.key, self._cpp.get_build_configuration_key()):
+        self._logger.warn(f"{target.key} was linked with another build configuration and will be relinked")
+        target.is_up_to_date = False
+
     try:
       for outdated_node in self._compilation_cache.get_all_outdated_nodes():
         self._logger.warn(f"{outdated_node.key} seems out of date and will be recompiled")
         self._compilation_graph.mark_node_as_outdated(outdated_node)
+        self._record_change(outdated_node.key)
     except:
       self._logger.error("could not read cache file correctly")
 
     super().__init__()
 
-  def _on_compilation_graph_build_success(self) -> None:
+  def _use_build_configuration(self) -> None:
+    build_configuration_key = self._cpp.get_build_configuration_key()
+    objects_root_dir = path.join(self._options["WORKING_DIR"], self._options["OBJ_DIR"]) if len(self._options["OBJ_DIR"]) else None
+    self._build_configurations = BuildConfigurations(self._cpp.get_build_configurations_file_path(), objects_root_dir)
+
+    if not objects_root_dir is None and not self._build_configurations.get(build_configuration_key) is None:
+      self._logger.info(f"reusing the object files of build configuration {build_configuration_key} in \"{self._cpp.get_object_dir()}\"")
+    else:
+      self._logger.info(f"using build configuration {build_configuration_key} ({self._options['CXX']} {self._options['CFLAGS']})")
+
+    for removed_key in self._build_configurations.use(build_configuration_key, self._options, self._options["KEEP_CONFIGURATIONS"]):
+      self._logger.warn(f"removed the object files of least recently used build configuration {removed_key}")
+
+  def _create_target_process(self, target : SimpleCppHotReloaderTargetOptions) -> AsyncProcess:
+    target_logger = Logger({"NAME": target["TARGET"], "SUCCESS_COLOR": "GREEN", "INFO_COLOR": "WHITE", "ERROR_COLOR": "MAGENTA", "WARN_COLOR": "CYAN"})
+    return AsyncProcess(
+      self._cpp.get_target_command(target),
+      {
+        "name": target["TARGET"],
+        "logger": lambda l: target_logger.warn(l),
+        "stdout_logger": lambda l: target_logger.info(l),
+        "stderr_logger": lambda l: target_logger.error(l),
+      }
+    )
+
+  def _export_compilation_database(self, inserted_keys : List[str], removed_keys : List[str]) -> None:
+    if self._compilation_database_writer is None:
+      return
+    for key in removed_keys:
+      self._compilation_database_writer.remove(key)
+    for key in inserted_keys:
+      if not self._cpp.is_header(key):
+        self._compilation_database_writer.insert(key, self._cpp.get_compile_command(key))
+    self._compilation_database_writer.write()
+
+  def _record_change(self, key : str) -> None:
+    if not self._impacted_test_runner is None:
+      self._impacted_test_runner.record_change(key)
+
+  def _on_compilation_graph_build_success(self, target : CompilationGraphTarget) -> None:
     self._compilation_cache.write_to_cache_file()
-    if 'R' in self._options["MODE"]:
-      if self._cpp.is_target_built():
-        self._target_process.terminate_and_run()
+    if "C" in self._options["MODE"]:
+      self._build_configurations.record_link(target.key, self._cpp.get_build_configuration_key())
+    with self._link_success_condition:
+      self._link_success_count += 1
+      self._last_linked_target = target.key
+      self._link_success_condition.notify_all()
+    if 'R' in self._options["MODE"] and target.options["RESTART"]:
+      if self._cpp.is_target_built(target.options):
+        self._target_processes[target.key].terminate_and_run()
+    if not self._impacted_test_runner is None:
+      self._impacted_test_runner.on_target_linked(target)
+
+  def dispatch(self, event : FileSystemEvent) -> None:
+    if not self._event_recorder is None:
+      is_source_event = self._cpp.is_cpp_source_file(event.src_path) or (event.event_type == "moved" and self._cpp.is_cpp_source_file(event.dest_path))
+      # Other files (e.g. objects written by the compiler) are ignored by schr, only the tree structure matters to replay them
+      if is_source_event or (event.is_directory and event.event_type != "modified"):
+        self._event_recorder.record(event, is_source_event)
+    super().dispatch(event)
 
   def on_created(self, fse: DirCreatedEvent | FileCreatedEvent) -> None:
     if not self._cpp.is_cpp_source_file(fse.src_path):
@@ -62,6 +148,8 @@ class HotReloader(RegexMatchingEventHandler):
     node_key = fse.src_path
     node = self._compilation_graph.insert_node(node_key, True)
     self._compilation_cache.insert_node(node)
+    self._export_compilation_database([node.key], [])
+    self._record_change(node.key)
     
     self._logger.info(f"{node.key} created")
 
@@ -85,6 +173,8 @@ class HotReloader(RegexMatchingEventHandler):
       self._compilation_cache.remove_node(node.key)
       self._cpp.clean_object_file(node.key)
 
+    self._export_compilation_database([], [node.key for node in deleted_nodes])
+
   def on_moved(self, fse: DirMovedEvent | FileMovedEvent) -> None:
     if not self._cpp.is_cpp_source_file(fse.src_path):
       return
@@ -97,6 +187,8 @@ class HotReloader(RegexMatchingEventHandler):
     node = self._compilation_graph.move_node(old_node_key, moved_node_key)
     self._compilation_cache.move_node(old_node_key, node)
     self._cpp.clean_object_file(old_node_key)
+    self._export_compilation_database([node.key], [old_node_key])
+    self._record_change(node.key)
 
     if "C" in self._options["MODE"]:
       self._compilation_graph.build()
@@ -111,31 +203,114 @@ class HotReloader(RegexMatchingEventHandler):
       return
 
     self._compilation_cache.update_node(node_key)
+    self._compilation_graph.get_compilation_history().record_edit(node_key)
     node = self._compilation_graph.update_node(node_key)
+    self._record_change(node_key)
     
     self._logger.info(f"{node.key} modified")
 
     if "C" in self._options["MODE"]:
       self._compilation_graph.build()
 
-  def start(self):
+  def get_status(self) -> Dict:
+    targets = {
+      target.key: {
+        "up_to_date": target.is_up_to_date,
+        "linking": target.is_linking(),
+        "last_link_time": target.last_link_time,
+        "last_link_succeeded": target.last_link_succeeded
+      } for target in self._compilation_graph.get_all_targets()
+    }
+    dirty_nodes = self.get_dirty_nodes()
+    failed_nodes = self.get_failed_nodes()
+    building = self.is_building()
+
+    return {
+      "green": not building and len(dirty_nodes) == 0 and len(failed_nodes) == 0 and all(t["up_to_date"] and t["last_link_succeeded"] != False for t in targets.values()),
+      "building": building,
+      "dirty": len(dirty_nodes),
+      "failed": failed_nodes,
+      "targets": targets
+    }
+
+  def build_now(self) -> bool:
+    if self._compilation_graph.build():
+      return True
+    self._compilation_graph.link_outdated_targets()
+    return any(target.is_linking() for target in self._compilation_graph.get_all_targets())
+
+  def wait_for_link_success(self, timeout : Union[float, None] = None) -> Union[str, None]:
+    with self._link_success_condition:
+      link_success_count = self._link_success_count
+      if self._link_success_condition.wait_for(lambda: self._link_success_count != link_success_count, timeout):
+        return self._last_linked_target
+    return None
+
+  def get_dirty_nodes(self) -> List[str]:
+    return [node.key for node in self._compilation_graph.get_all_outdated_nodes()]
+
+  def get_failed_nodes(self) -> List[str]:
+    return [node.key for node in self._compilation_graph.get_all_non_header_nodes() if node.has_compilation_error]
+
+  def is_building(self) -> bool:
+    return self._compilation_graph.is_building()
+
+  def get_diagnostics(self) -> Dict:
+    return {
+      "nodes": {node.key: node.diagnostics for node in self._compilation_graph.get_all_non_header_nodes() if len(node.diagnostics)},
+      "targets": {target.key: target.diagnostics for target in self._compilation_graph.get_all_targets() if len(target.diagnostics)}
+    }
+
+  def run_first_round(self) -> None:
     self._logger.info(f"running first round")
 
     if self._options["MODE"] == "R":
       self._logger.warn("you are using R (Run) mode only. This will only start your target once and only if it is already compiled. If that’s all you’re after, then you're all set—no compilation, no re-linking, just a good old execution!")
-      self._on_compilation_graph_build_success() 
+      for target in self._compilation_graph.get_all_targets():
+        self._on_compilation_graph_build_success(target)
 
     if "C" in self._options["MODE"]:
-      self._compilation_graph.build(False) or self._on_compilation_graph_build_success() 
+      self._compilation_graph.build(False) or self._compilation_graph.link()
 
     self._logger.success(f"ok")
 
+  def start(self):
+    if self._options["DAEMON"]:
+      try:
+        self._daemon_server = DaemonServer(self._cpp.get_daemon_socket_path(), self)
+      except OSError as e:
+        self._logger.error(f"could not listen for schr clients: {e}")
+        exit(1)
+
+    self.run_first_round()
 
     self._logger.info(f"watching project \"{self._options['WORKING_DIR']}\"")
-    observer = Observer()
-    observer.schedule(self, self._options["WORKING_DIR"], recursive=True)
-    observer.start()
+    observer = None
+    if not self._options["POLLING"]:
+      try:
+        observer = Observer()
+        observer.schedule(self, self._options["WORKING_DIR"], recursive=True)
+        observer.start()
+      except OSError as e:
+        self._logger.warn(f"could not watch the project ({e}), falling back to polling")
+        observer = None
+    if observer is None:
+      excluded_dirs = [path.join(self._options["WORKING_DIR"], self._options["OBJ_DIR"])] if len(self._options["OBJ_DIR"]) else []
+      # Only the directories holding sources and headers of the graph, and their parents, are polled
+      observer = SnapshotObserver(self._cpp.is_cpp_source_file, excluded_dirs, self._logger, [node.key for node in self._compilation_graph.get_all_nodes()])
+      observer.schedule(self, self._options["WORKING_DIR"], recursive=True)
+      observer.start()
     signal(SIGINT, lambda _a, _b: observer.stop() or print())
     self._logger.success("ok")
 
+    if self._options["DAEMON"]:
+      self._logger.info(f"listening for schr clients on \"{self._cpp.get_daemon_socket_path()}\"")
+      self._daemon_server.start()
+      self._logger.success("ok")
+
     observer.join()
+
+    if not self._daemon_server is None:
+      self._daemon_server.stop()
+    if not self._event_recorder is None:
+      self._event_recorder.close()
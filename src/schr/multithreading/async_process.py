@@ -1,5 +1,7 @@
+from os import wait4, waitstatus_to_exitcode
 from subprocess import Popen, PIPE
 from threading import Thread
+from time import perf_counter
 from typing import List, IO, Union, Callable, TypedDict
 
 class AsyncProcessOptions (TypedDict) :
@@ -14,6 +16,10 @@ class AsyncProcess:
 
   _command_thread : Union[Thread, None] = None
   _command_process : Union[Popen, None] = None
+  exit_code : Union[int, None] = None
+  # Peak resident set size of the process and its waited children in bytes, and wall time in seconds, of the last run
+  peak_rss : Union[int, None] = None
+  duration : Union[float, None] = None
 
   def __init__(self, command : List[str], options : AsyncProcessOptions):
     self._command = command
@@ -33,6 +39,8 @@ class AsyncProcess:
     if "logger" in self._options:
       self._options["logger"](f'starting process: "{self._options["name"]}"')
 
+    self.peak_rss = None
+    self._started_at = perf_counter()
     self._command_process = Popen(
       self._command,
       stdout=PIPE if "stdout_logger" in self._options else None,
@@ -59,6 +67,11 @@ class AsyncProcess:
 
     self._trigger_callback = True
 
+  def wait(self) -> Union[int, None] :
+    if self.is_running():
+      self._command_thread.join()
+    return self.exit_code
+
   def run_with_command(self, new_command: List[str]) -> None :
     self._command = new_command
     self.run()
@@ -77,7 +90,9 @@ class AsyncProcess:
 
     for t in stream_threads:
       t.start()
-    exit_code = self._command_process.wait()
+    exit_code = self._wait_process()
+    self.exit_code = exit_code
+    self.duration = perf_counter() - self._started_at
     self._command_process = None
     for t in stream_threads:
       t.join()
@@ -91,6 +106,19 @@ class AsyncProcess:
       elif "on_error" in self._options:
         self._options["on_error"]()
 
+  def _wait_process(self) -> int :
+    try:
+      _, status, rusage = wait4(self._command_process.pid, 0)
+    except ChildProcessError:
+      # Already reaped by Popen (eg terminate polls the process), the exit code is known but not the resource usage
+      return self._command_process.wait()
+
+    exit_code = waitstatus_to_exitcode(status)
+    self._command_process.returncode = exit_code
+    # ru_maxrss is given in kilobytes on linux
+    self.peak_rss = rusage.ru_maxrss * 1024
+    return exit_code
+
   def _watch_stream(self, stream : IO[str], log_func : Callable[[str], None]) -> None :
     try:
       for line in iter(stream.readline, ''):
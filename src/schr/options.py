@@ -1,5 +1,16 @@
+from json import load
 from typing import List, Union, TypedDict
 
+class SimpleCppHotReloaderTargetOptions(TypedDict):
+  TARGET: str
+  TARGET_ARGS: str
+  LDFLAGS: str
+  SOURCES: List[str]
+  RESTART: bool
+  TEST: bool
+  TEST_SOURCES: List[str]
+  GTEST: bool
+
 class SimpleCppHotReloaderOptions(TypedDict):
   WORKING_DIR: str
   CXX: str
@@ -10,8 +21,68 @@ class SimpleCppHotReloaderOptions(TypedDict):
   HXX_FILE_EXTS: List[str]
   TARGET: str
   TARGET_ARGS: str
+  TARGETS: List[SimpleCppHotReloaderTargetOptions]
+  TARGETS_FILE: str
   MODE: str
   DEBUG: bool
+  DAEMON: bool
+  COMPDB_IMPORT: str
+  COMPDB_EXPORT: str
+  JOBS: int
+  WORKERS: List[str]
+  # Bytes of memory local compilations may use at once, 0 to use most of the available memory
+  MEMORY_BUDGET: int
+  RECORD: str
+  POLLING: bool
+  # Number of build configurations (compiler and flags) whose object files are kept in OBJ_DIR
+  KEEP_CONFIGURATIONS: int
+  PARTIAL_LINK: bool
+
+def get_targets(options : SimpleCppHotReloaderOptions) -> List[SimpleCppHotReloaderTargetOptions]:
+  """
+  Returns the targets described by options.TARGETS, or the single target described by options.TARGET when no targets are set
+  """
+  if len(options["TARGETS"]):
+    return options["TARGETS"]
+
+  return [{
+    "TARGET": options["TARGET"],
+    "TARGET_ARGS": options["TARGET_ARGS"],
+    "LDFLAGS": "",
+    "SOURCES": [],
+    "RESTART": True,
+    "TEST": False,
+    "TEST_SOURCES": [],
+    "GTEST": False
+  }]
+
+def load_targets_file(targets_file_path : str) -> List[SimpleCppHotReloaderTargetOptions]:
+  """
+  Reads a json file containing a list of targets, e.g. [{"target": "bin/server", "sources": ["src/lib/*", "src/server/*"], "lflags": "-lssl", "args": "--port 8080", "restart": true}]
+  Test targets set "test": true, and optionally "tests" (globs of their test sources) and "gtest": true to run only impacted test cases
+  """
+  with open(targets_file_path, "r") as fd:
+    raw_targets = load(fd)
+
+  if not isinstance(raw_targets, list):
+    raise ValueError(f"load_targets_file: {targets_file_path} must contain a list of targets")
+
+  targets = []
+  for raw_target in raw_targets:
+    if not isinstance(raw_target, dict) or not isinstance(raw_target.get("target"), str):
+      raise ValueError(f"load_targets_file: each target of {targets_file_path} must at least define a \"target\" path")
+    targets.append({
+      "TARGET": raw_target["target"],
+      "TARGET_ARGS": raw_target.get("args", ""),
+      "LDFLAGS": raw_target.get("lflags", ""),
+      "SOURCES": list(raw_target.get("sources", [])),
+      "RESTART": bool(raw_target.get("restart", not raw_target.get("test", False))),
+      "TEST": bool(raw_target.get("test", False)),
+      "TEST_SOURCES": list(raw_target.get("tests", [])),
+      "GTEST": bool(raw_target.get("gtest", False))
+    })
+
+  return targets
 
 def as_makefile(options : SimpleCppHotReloaderOptions) -> str:
     return f"""CXX="{options["CXX"]}"
@@ -20,11 +91,21 @@ LDFLAGS="{options["LDFLAGS"]}"
 OBJ_DIR="{options["OBJ_DIR"]}"
 TARGET="{options["TARGET"]}"
 TARGET_ARGS="{options["TARGET_ARGS"]}"
+TARGETS_FILE="{options["TARGETS_FILE"]}"
 
 SCHR_MODE={options["MODE"]}
 SCHR_DEBUG={"-d" if options["DEBUG"] else ""}
+SCHR_DAEMON={"--daemon" if options["DAEMON"] else ""}
+SCHR_COMPDB={f'-ic "{options["COMPDB_IMPORT"]}" ' if len(options["COMPDB_IMPORT"]) else ""}{f'-ec "{options["COMPDB_EXPORT"]}"' if len(options["COMPDB_EXPORT"]) else ""}
+SCHR_JOBS={options["JOBS"]}
+SCHR_WORKERS="{",".join(options["WORKERS"])}"
+SCHR_MEMORY_BUDGET={options["MEMORY_BUDGET"] >> 20}
+SCHR_KEEP_CONFIGURATIONS={options["KEEP_CONFIGURATIONS"]}
+SCHR_POLL={"--poll" if options["POLLING"] else ""}
+SCHR_PARTIAL_LINK={"--partial-link" if options["PARTIAL_LINK"] else ""}
+SCHR_RECORD={f'--record "{options["RECORD"]}"' if len(options["RECORD"]) else ""}
 
 # Run the following with make dev
 dev:
-\tpython ./cli.py -c $(CXX) -cf=$(CFLAGS) -ld=$(LDFLAGS) -od $(OBJ_DIR) -t $(TARGET) -ta=$(TARGET_ARGS) -m $(SCHR_MODE) $(SCHR_DEBUG)
-"""
\ No newline at end of file
+\tpython ./cli.py -c $(CXX) -cf=$(CFLAGS) -ld=$(LDFLAGS) -od $(OBJ_DIR) {"-t $(TARGET) -ta=$(TARGET_ARGS) " if options["TARGET"] else ""}{"-tf $(TARGETS_FILE) " if options["TARGETS_FILE"] else ""}-m $(SCHR_MODE) -j $(SCHR_JOBS) -mb $(SCHR_MEMORY_BUDGET) -kc $(SCHR_KEEP_CONFIGURATIONS) {"-w $(SCHR_WORKERS) " if len(options["WORKERS"]) else ""}$(SCHR_DEBUG) $(SCHR_DAEMON) $(SCHR_COMPDB) $(SCHR_RECORD) $(SCHR_POLL) $(SCHR_PARTIAL_LINK)
+"""
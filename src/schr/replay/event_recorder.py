@@ -0,0 +1,83 @@
+from json import dumps
+from os import makedirs, replace
+from os.path import exists, join, relpath, isfile
+from shutil import copyfile
+from threading import Lock
+from time import perf_counter, time
+from typing import Dict, List, Union
+
+from watchdog.events import FileSystemEvent
+
+from ..cache.compilation_cache import hash_file
+from ..options import SimpleCppHotReloaderOptions
+
+RECORD_VERSION = 1
+# Events handled by schr, opened and closed events are mostly caused by schr reading the sources itself
+RECORDED_EVENT_TYPES = ["created", "deleted", "modified", "moved"]
+
+def get_objects_dir(record_file_path : str) -> str :
+  return f"{record_file_path}.objects"
+
+class EventRecorder:
+  """
+  Appends the filesystem events received by schr to a json lines file, with the content of the source files they touch.
+  Contents are stored once per blake2b digest in a directory next to the record file, so that a session can be replayed on a copy of the tree
+  """
+
+  def __init__(self, record_file_path : str, options : SimpleCppHotReloaderOptions, source_file_paths : List[str]):
+    self._record_file_path = record_file_path
+    self._objects_dir = get_objects_dir(record_file_path)
+    self._working_dir = options["WORKING_DIR"]
+    self._lock = Lock()
+
+    makedirs(self._objects_dir, exist_ok=True)
+    snapshot = {}
+    for source_file_path in source_file_paths:
+      if (digest := self._snapshot(source_file_path)) is not None:
+        snapshot[relpath(source_file_path, self._working_dir)] = digest
+
+    self._fd = open(self._record_file_path, "w")
+    self._write({"version": RECORD_VERSION, "started_at": time(), "options": options, "snapshot": snapshot})
+    self._started_at = perf_counter()
+
+  def _snapshot(self, file_path : str) -> Union[str, None] :
+    try:
+      digest = hash_file(file_path).hex()
+      object_path = join(self._objects_dir, digest)
+      if not exists(object_path):
+        copyfile(file_path, f"{object_path}.tmp")
+        replace(f"{object_path}.tmp", object_path)
+      return digest
+    except OSError:
+      # The file may already be gone, the following events will tell
+      return None
+
+  def _write(self, entry : Dict) -> None :
+    self._fd.write(f"{dumps(entry)}\n")
+    self._fd.flush()
+
+  def record(self, event : FileSystemEvent, snapshot_content : bool) -> None :
+    if not event.event_type in RECORDED_EVENT_TYPES or event.src_path.startswith(self._record_file_path):
+      # Writing the record would record itself forever when it is stored in the watched directory
+      return
+
+    entry = {
+      "time": round(perf_counter() - self._started_at, 6),
+      "event": event.event_type,
+      "src": relpath(event.src_path, self._working_dir),
+      "dest": relpath(event.dest_path, self._working_dir) if event.event_type == "moved" else None,
+      "is_directory": event.is_directory,
+      "hash": None
+    }
+
+    if snapshot_content and event.event_type in ["created", "modified", "moved"]:
+      snapshot_path = event.dest_path if event.event_type == "moved" else event.src_path
+      if isfile(snapshot_path):
+        entry["hash"] = self._snapshot(snapshot_path)
+
+    with self._lock:
+      self._write(entry)
+
+  def close(self) -> None :
+    with self._lock:
+      self._fd.close()
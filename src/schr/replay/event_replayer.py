@@ -0,0 +1,186 @@
+from __future__ import annotations
+from json import loads
+from os import makedirs, remove, renames
+from os.path import dirname, exists, isabs, isdir, join, normpath, relpath, sep
+from shutil import copyfile, rmtree
+from statistics import median
+from time import perf_counter, sleep
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from watchdog.events import FileSystemEvent, DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+
+from .event_recorder import RECORD_VERSION, get_objects_dir
+from ..options import SimpleCppHotReloaderOptions, get_targets
+from ..utils.logger import Logger
+
+if TYPE_CHECKING:
+  from ..hot_reloader import HotReloader
+
+EVENT_TYPES = {
+  ("created", False): FileCreatedEvent,
+  ("created", True): DirCreatedEvent,
+  ("deleted", False): FileDeletedEvent,
+  ("deleted", True): DirDeletedEvent,
+  ("modified", False): FileModifiedEvent,
+  ("modified", True): DirModifiedEvent,
+  ("moved", False): FileMovedEvent,
+  ("moved", True): DirMovedEvent
+}
+
+def load_record(record_file_path : str) -> Tuple[Dict, List[Dict]] :
+  with open(record_file_path, "r") as fd:
+    header = loads(fd.readline())
+    if header.get("version") != RECORD_VERSION:
+      raise ValueError(f"unsupported record version {header.get('version')}")
+    events = [loads(line) for line in fd if len(line.strip())]
+  return header, events
+
+def split_bursts(events : List[Dict], burst_gap : float) -> List[List[Dict]] :
+  bursts = []
+  for event in events:
+    if not len(bursts) or event["time"] - bursts[-1][-1]["time"] > burst_gap:
+      bursts.append([])
+    bursts[-1].append(event)
+  return bursts
+
+class EventReplayer:
+  """
+  Replays a session recorded with --record on a fresh copy of the recorded tree, one burst of events at a time,
+  and measures the time from the first event of each burst until schr is done compiling and linking
+  """
+
+  POLL_INTERVAL = 0.01
+
+  def __init__(self, record_file_path : str, replay_dir : str, logger : Logger):
+    self._objects_dir = get_objects_dir(record_file_path)
+    self._replay_dir = replay_dir
+    self._logger = logger
+    self._header, self._events = load_record(record_file_path)
+    self._options = self._rebase_options()
+    if len(self._header["options"].get("COMPDB_IMPORT", "")):
+      self._logger.warn("the imported compilation database describes the recorded tree, it is not used by the replay")
+
+  def _rebase_path(self, option : str, value : str) -> str :
+    """
+    Makes a path of the recorded tree relative to it, so that it resolves in the replay directory.
+    Paths outside of the recorded tree are refused since the replay would write to them
+    """
+    relative_path = relpath(value, self._header["options"]["WORKING_DIR"]) if isabs(value) else normpath(value)
+    if relative_path == ".." or relative_path.startswith(f"..{sep}"):
+      raise ValueError(f"{option} \"{value}\" is outside of the recorded tree")
+    return relative_path
+
+  def _rebase_options(self) -> SimpleCppHotReloaderOptions :
+    options = SimpleCppHotReloaderOptions({**self._header["options"]})
+    options["WORKING_DIR"] = self._replay_dir
+    options["MODE"] = "C"
+    options["DAEMON"] = False
+    options["COMPDB_IMPORT"] = ""
+    options["COMPDB_EXPORT"] = ""
+    options["RECORD"] = ""
+    options["KEEP_CONFIGURATIONS"] = 1
+    options["PARTIAL_LINK"] = options.get("PARTIAL_LINK", False)
+    if len(options["OBJ_DIR"]):
+      options["OBJ_DIR"] = self._rebase_path("OBJ_DIR", options["OBJ_DIR"])
+    if len(options["TARGET"]):
+      options["TARGET"] = self._rebase_path("TARGET", options["TARGET"])
+    if len(options["TARGETS_FILE"]):
+      options["TARGETS_FILE"] = self._rebase_path("TARGETS_FILE", options["TARGETS_FILE"])
+    options["TARGETS"] = [{**target, "TARGET": self._rebase_path("TARGET", target["TARGET"])} for target in options["TARGETS"]]
+    return options
+
+  def get_options(self) -> SimpleCppHotReloaderOptions :
+    """
+    Recorded options rebased on the replay directory, without side effects outside of it
+    """
+    return SimpleCppHotReloaderOptions({**self._options, "TARGETS": [{**target} for target in self._options["TARGETS"]]})
+
+  def restore_snapshot(self) -> None :
+    for relative_path, digest in self._header["snapshot"].items():
+      self._restore(relative_path, digest)
+    # Directories of the targets are not recorded, they held no source file
+    for target in get_targets(self.get_options()):
+      makedirs(dirname(join(self._replay_dir, target["TARGET"])), exist_ok=True)
+
+  def _restore(self, relative_path : str, digest : str) -> None :
+    file_path = join(self._replay_dir, relative_path)
+    makedirs(dirname(file_path), exist_ok=True)
+    copyfile(join(self._objects_dir, digest), file_path)
+
+  def _apply(self, event : Dict) -> FileSystemEvent :
+    src_path = join(self._replay_dir, event["src"])
+
+    if event["event"] == "moved":
+      dest_path = join(self._replay_dir, event["dest"])
+      if exists(src_path):
+        renames(src_path, dest_path)
+      if not event["hash"] is None:
+        self._restore(event["dest"], event["hash"])
+      return EVENT_TYPES[("moved", event["is_directory"])](src_path, dest_path)
+
+    if event["event"] == "deleted":
+      if isdir(src_path):
+        rmtree(src_path, ignore_errors=True)
+      elif exists(src_path):
+        remove(src_path)
+    elif event["is_directory"] and event["event"] == "created":
+      makedirs(src_path, exist_ok=True)
+    elif not event["hash"] is None:
+      self._restore(event["src"], event["hash"])
+
+    return EVENT_TYPES[(event["event"], event["is_directory"])](src_path)
+
+  def _wait_until_settled(self, hot_reloader : HotReloader, timeout : float) -> bool :
+    """
+    Waits for the graph to stop compiling and linking, twice in a row since a link starts right after the last compilation ends
+    """
+    deadline = perf_counter() + timeout
+    settled_polls = 0
+    while perf_counter() < deadline:
+      settled_polls = 0 if hot_reloader.is_building() else settled_polls + 1
+      if settled_polls == 2:
+        return True
+      sleep(self.POLL_INTERVAL)
+    return False
+
+  def replay(self, hot_reloader : HotReloader, speed : float, burst_gap : float, timeout : float) -> List[Dict] :
+    """
+    speed scales the recorded delays (1 for real timing), 0 replays every burst as soon as the previous one is built
+    """
+    started_at = perf_counter()
+    hot_reloader.run_first_round()
+    self._wait_until_settled(hot_reloader, timeout)
+    self._logger.info(f"initial build done in {perf_counter() - started_at:.2f}s")
+
+    results = []
+    bursts = split_bursts(self._events, burst_gap)
+    for i, burst in enumerate(bursts):
+      if i > 0 and speed > 0:
+        # The previous build time counts in the recorded delay, as it did while recording
+        sleep(max((burst[0]["time"] - bursts[i - 1][-1]["time"]) * speed - (perf_counter() - dispatched_at), 0))
+
+      started_at = perf_counter()
+      for j, event in enumerate(burst):
+        if j > 0 and speed > 0:
+          sleep((event["time"] - burst[j - 1]["time"]) * speed)
+        hot_reloader.dispatch(self._apply(event))
+      dispatched_at = perf_counter()
+
+      settled = self._wait_until_settled(hot_reloader, timeout)
+      latency = perf_counter() - started_at
+
+      result = {
+        "burst": i,
+        "events": len(burst),
+        "files": len({event["src"] for event in burst}),
+        "latency": round(latency, 4),
+        "settled": settled,
+        "failed": hot_reloader.get_failed_nodes()
+      }
+      results.append(result)
+      self._logger.info(f"burst {i + 1}/{len(bursts)}: {result['events']} events on {result['files']} files built in {latency:.3f}s{'' if settled else ' (timed out)'}")
+
+    if len(results):
+      latencies = sorted(result["latency"] for result in results)
+      self._logger.success(f"{len(results)} bursts replayed, median latency {median(latencies):.3f}s, max latency {latencies[-1]:.3f}s")
+    return results
@@ -0,0 +1,136 @@
+from __future__ import annotations
+from os.path import splitext
+from re import MULTILINE, compile as compile_regex
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Set, Union
+
+from ..compilation.compilation_graph import CompilationGraph, CompilationGraphSimpleNode, CompilationGraphTarget
+from ..multithreading.async_process import AsyncProcess
+from ..utils.cpp import CppUtils
+from ..utils.logger import Logger
+
+GTEST_CASE_REGEX = compile_regex(r"^\s*(TEST|TEST_F|TEST_P|TYPED_TEST|TYPED_TEST_P)\s*\(\s*(\w+)\s*,\s*(\w+)\s*\)", MULTILINE)
+
+class ImpactedTestRunner:
+  """
+  Maps the changed files to the test sources depending on them through the included_in closure of the graph,
+  and runs only the impacted test targets (and gtest cases) once they are relinked
+  """
+
+  _changes : Dict[str, Set[str]]
+  _processes : Dict[str, AsyncProcess]
+  _started_at : Dict[str, float]
+
+  def __init__(self, compilation_graph : CompilationGraph, cpp : CppUtils, logger : Logger):
+    self._compilation_graph = compilation_graph
+    self._cpp = cpp
+    self._logger = logger
+
+    self._changes = {target.key: set() for target in self._compilation_graph.get_all_targets() if target.options["TEST"]}
+    self._processes = {}
+    self._started_at = {}
+    self._lock = Lock()
+
+  def record_change(self, key : str) -> None :
+    with self._lock:
+      for changes in self._changes.values():
+        changes.add(key)
+
+  def get_test_nodes(self, target : CompilationGraphTarget) -> List[CompilationGraphSimpleNode] :
+    test_target = {**target.options, "SOURCES": target.options["TEST_SOURCES"]}
+    return [node for node in target.get_all_nodes() if self._cpp.is_target_source(test_target, node.key)]
+
+  def get_impacted_test_nodes(self, target : CompilationGraphTarget, changed_keys : Set[str]) -> List[CompilationGraphSimpleNode] :
+    test_nodes = self.get_test_nodes(target)
+    impacted_nodes = set()
+
+    for key in changed_keys:
+      node = self._compilation_graph.get_node(key)
+      if node is None:
+        continue
+
+      seeds = [node]
+      if not node.is_header:
+        # A source file change impacts the users of its interface, ie the headers sharing its name
+        stem = splitext(node.key)[0]
+        seeds.extend(filter(None, map(self._compilation_graph.get_node, (f"{stem}{ext}" for ext in self._cpp.get_header_file_extensions()))))
+        if len(seeds) == 1 and not node in test_nodes and target.has_node(node):
+          return test_nodes
+
+      impacted_nodes.update(self._get_included_in_closure(seeds))
+
+    return [node for node in test_nodes if node in impacted_nodes]
+
+  def _get_included_in_closure(self, seeds : List[CompilationGraphSimpleNode]) -> Set[CompilationGraphSimpleNode] :
+    closure = set(seeds)
+    nodes_to_visit = list(seeds)
+    while len(nodes_to_visit):
+      for node in nodes_to_visit.pop().included_in:
+        if not node in closure:
+          closure.add(node)
+          nodes_to_visit.append(node)
+    return closure
+
+  def get_gtest_filter(self, test_nodes : List[CompilationGraphSimpleNode]) -> Union[str, None] :
+    patterns = []
+    for node in test_nodes:
+      try:
+        with open(node.key, "r", errors="replace") as fd:
+          source = fd.read()
+      except OSError:
+        return None
+
+      cases = GTEST_CASE_REGEX.findall(source)
+      if not len(cases):
+        # Test cases may be generated by macros, run everything to stay safe
+        return None
+
+      for macro, suite, name in cases:
+        if macro == "TEST_P":
+          patterns.append(f"*/{suite}.{name}/*")
+        elif macro in ["TYPED_TEST", "TYPED_TEST_P"]:
+          patterns.append(f"{suite}*.{name}")
+        else:
+          patterns.append(f"{suite}.{name}")
+
+    return ":".join(dict.fromkeys(patterns))
+
+  def on_target_linked(self, target : CompilationGraphTarget) -> None :
+    if not target.key in self._changes:
+      return
+
+    with self._lock:
+      changed_keys = self._changes[target.key]
+      self._changes[target.key] = set()
+
+    impacted_test_nodes = self.get_impacted_test_nodes(target, changed_keys)
+    if not len(impacted_test_nodes):
+      self._logger.info(f"no tests of {target.key} impacted by your changes")
+      return
+
+    command = self._cpp.get_target_command(target.options)
+    if target.options["GTEST"] and (gtest_filter := self.get_gtest_filter(impacted_test_nodes)):
+      command.append(f"--gtest_filter={gtest_filter}")
+
+    self._logger.info(f"running {len(impacted_test_nodes)} impacted test sources of {target.key}")
+    self._run(target, command)
+
+  def _run(self, target : CompilationGraphTarget, command : List[str]) -> None :
+    if not target.key in self._processes:
+      test_logger = Logger({"NAME": target.key, "SUCCESS_COLOR": "GREEN", "INFO_COLOR": "WHITE", "ERROR_COLOR": "MAGENTA", "WARN_COLOR": "CYAN"})
+      self._processes[target.key] = AsyncProcess(
+        command,
+        {
+          "name": target.key,
+          "stdout_logger": lambda l: test_logger.info(l),
+          "stderr_logger": lambda l: test_logger.error(l),
+          "on_success": lambda: self._logger.success(f"tests of {target.key} passed in {perf_counter() - self._started_at[target.key]:.2f}s"),
+          "on_error": lambda: self._logger.error(f"tests of {target.key} failed in {perf_counter() - self._started_at[target.key]:.2f}s")
+        }
+      )
+
+    process = self._processes[target.key]
+    process.terminate()
+    self._started_at[target.key] = perf_counter()
+    process.run_with_command(command)
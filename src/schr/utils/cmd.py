@@ -1,4 +1,4 @@
-from subprocess import Popen, PIPE, run
+from subprocess import Popen, PIPE, DEVNULL, run
 from typing import List
 from .fs import sanitize_file_extensions
 
@@ -8,7 +8,7 @@ def run_piped_command(commands : List[List[str]], printCmd : bool = False) -> Li
 
   prevStdout = None
   for c in commands:
-    cp = Popen(c, stdin=prevStdout, stdout=PIPE, stderr=PIPE)
+    cp = Popen(c, stdin=prevStdout, stdout=PIPE, stderr=DEVNULL)
     prevStdout = cp.stdout
 
   return list(map(lambda l : l.decode().strip("\n\r"), prevStdout.readlines()))
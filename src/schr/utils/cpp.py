@@ -1,14 +1,24 @@
-from os import sep, makedirs, remove, listdir, rmdir
-from os.path import abspath, exists, dirname, join
+from os import sep, makedirs, remove, listdir, rmdir, replace
+from fnmatch import fnmatch
+from hashlib import blake2b
+from os.path import abspath, exists, dirname, join, getmtime, basename, splitext
 from re import match
-from typing import List
+from threading import Lock
+from typing import Dict, List, Union
 
 from .fs import change_file_ext, get_relative_path_from, file_ext_regex, get_all_files_in_dir
 from .cmd import grep_file_extensions_regex, run_piped_command
-from ..options import SimpleCppHotReloaderOptions
+from ..cache.build_configurations import get_build_configuration_key
+from ..compilation.compilation_database import CompilationDatabase
+from ..compilation.module_scanner import SourceModules, NO_SOURCE_MODULES, scan_source_modules
+from ..options import SimpleCppHotReloaderOptions, SimpleCppHotReloaderTargetOptions
 
 class CppUtils  :
 
+  MODULE_INTERFACE_FILE_EXTS = [".cppm", ".ixx", ".mpp", ".cxxm"]
+
+  _source_modules : Dict[str, SourceModules]
+
   def __init__(self, options : SimpleCppHotReloaderOptions):
     if not len(options["HXX_FILE_EXTS"]):
       raise ValueError("CppUtils.__init__: options.HXX_FILE_EXTS must be a non empty list")
@@ -21,6 +31,10 @@ class CppUtils  :
     self._cpp_source_file_regex = file_ext_regex(self._cpp_source_file_extensions)
     self._header_file_regex = file_ext_regex(self._options["HXX_FILE_EXTS"])
     self._grep_extract_includes_regex = grep_file_extensions_regex(self._cpp_source_file_extensions)
+    self._compilation_database = CompilationDatabase(self._options["COMPDB_IMPORT"]) if len(self._options["COMPDB_IMPORT"]) else None
+    self._source_modules = {}
+    self._source_modules_lock = Lock()
+    self._build_configuration_key = get_build_configuration_key(self._options)
   
   def get_cpp_source_file(self) -> List[str] :
     return get_all_files_in_dir(self._options["WORKING_DIR"], self._cpp_source_file_extensions)
@@ -28,24 +42,88 @@ class CppUtils  :
   def is_cpp_source_file(self, file_path : str) -> bool :
     return not match(self._cpp_source_file_regex, file_path) is None
 
+  def get_header_file_extensions(self) -> List[str] :
+    return self._options["HXX_FILE_EXTS"]
+
   def is_header(self, cpp_source_path : str) -> bool:
     return not match(self._header_file_regex, cpp_source_path) is None
 
+  def _get_database_command(self, cpp_source_path : str) -> Union[List[str], None] :
+    if self._compilation_database is None:
+      return None
+    return self._compilation_database.get_command(cpp_source_path)
+
   def get_compile_command(self, cpp_source_path : str) -> List[str] :
+    if database_command := self._get_database_command(cpp_source_path):
+      return [*database_command, "-c", cpp_source_path, "-o", abspath(self.get_object_file_path(cpp_source_path))]
+
     return [
       self._options["CXX"],
       *(self._options["CFLAGS"].split(" ") or []),
+      *self.get_module_flags(cpp_source_path),
       "-c",
-      cpp_source_path,
+      *self.get_module_source_arguments(cpp_source_path),
       "-o",
       self.get_object_file_path(cpp_source_path),
       *(self._options["LDFLAGS"].split(" ") or [])
     ]
 
+  def get_compiler(self, cpp_source_path : str) -> str :
+    if database_command := self._get_database_command(cpp_source_path):
+      return database_command[0]
+    return self._options["CXX"]
+
+  def get_preprocess_command(self, cpp_source_path : str) -> List[str] :
+    if database_command := self._get_database_command(cpp_source_path):
+      return [*database_command, "-E", cpp_source_path]
+
+    return [
+      self._options["CXX"],
+      *self._options["CFLAGS"].split(),
+      "-E",
+      cpp_source_path
+    ]
+
+  def get_remote_compile_flags(self, cpp_source_path : str) -> List[str] :
+    """
+    Flags compiling the preprocessed source of cpp_source_path on a worker, the preprocessor flags are dropped since preprocessing happens on this machine
+    """
+    if database_command := self._get_database_command(cpp_source_path):
+      flags = database_command[1:]
+    else:
+      flags = self._options["CFLAGS"].split()
+
+    remote_flags = []
+    arguments = iter(flags)
+    for argument in arguments:
+      if argument in CompilationDatabase.PATH_FLAGS + ["-D", "-U"]:
+        next(arguments, None)
+        continue
+      if any(argument.startswith(f) for f in CompilationDatabase.PATH_FLAGS + ["-D", "-U"]):
+        continue
+      remote_flags.append(argument)
+    return remote_flags
+
+  def get_source_language(self, cpp_source_path : str) -> str :
+    return "c" if cpp_source_path.endswith(".c") else "c++"
+
+  def get_build_configuration_key(self) -> str :
+    return self._build_configuration_key
+
+  def get_object_dir(self) -> str :
+    """
+    Directory of the object files built with the current compiler and flags, each configuration has its own directory of OBJ_DIR
+    """
+    if not len(self._options["OBJ_DIR"]):
+      return ""
+    return f"{self._options['OBJ_DIR']}{sep}{self._build_configuration_key}"
+
   def get_object_file_path(self, cpp_source_path : str) -> str:
+    # Module interfaces usually share their name with their implementation unit (e.g. m.cppm and m.cpp)
+    object_file_ext = f"{splitext(cpp_source_path)[1]}.o" if self.is_module_interface_file(cpp_source_path) else ".o"
     if not len(self._options["OBJ_DIR"]):
-      return change_file_ext(cpp_source_path, ".o")
-    return f"{self._options['OBJ_DIR']}{sep}{change_file_ext(get_relative_path_from(self._options['WORKING_DIR'], cpp_source_path), '.o')}"
+      return change_file_ext(cpp_source_path, object_file_ext)
+    return f"{self.get_object_dir()}{sep}{change_file_ext(get_relative_path_from(self._options['WORKING_DIR'], cpp_source_path), object_file_ext)}"
 
   def get_object_file_dir(self, cpp_source_path : str) -> str :
     return dirname(get_relative_path_from(self._options["WORKING_DIR"], self.get_object_file_path(cpp_source_path)))
@@ -57,9 +135,12 @@ class CppUtils  :
   def clean_object_file(self, cpp_source_path : str) -> None :
     cpp_object_file_path = self.get_object_file_path(cpp_source_path)
     cpp_object_file_dir = self.get_object_file_dir(cpp_source_path)
+    provided_module = self.get_provided_module(cpp_source_path)
 
     try:
       remove(cpp_object_file_path)
+      if not provided_module is None:
+        remove(self.get_module_interface_file_path(cpp_source_path, provided_module))
     except:
       pass
 
@@ -70,6 +151,9 @@ class CppUtils  :
       pass
 
   def get_cpp_command(self, cpp_source_path : str) -> List[str] :
+    if not self._compilation_database is None and (preprocessor_flags := self._compilation_database.get_preprocessor_flags(cpp_source_path)) is not None:
+      return ["cpp", "-H", cpp_source_path, *preprocessor_flags]
+
     return [
       "cpp",
       "-H",
@@ -77,15 +161,44 @@ class CppUtils  :
       *(self._options["CFLAGS"].split(" ") or []),
     ]
 
-  def get_link_command(self, object_file_paths : List[str]) -> List[str] :
+  def get_link_command(self, object_file_paths : List[str], target : SimpleCppHotReloaderTargetOptions) -> List[str] :
     return [
       self._options["CXX"],
       *(self._options["CFLAGS"].split(" ") or []),
       "-o",
-      self._options["TARGET"],
+      target["TARGET"],
       *object_file_paths,
-      *(self._options["LDFLAGS"].split(" ") or [])
+      *(self._options["LDFLAGS"].split(" ") or []),
+      *target["LDFLAGS"].split()
+    ]
+
+  def get_partial_link_dir(self) -> str :
+    return abspath(join(self._options["WORKING_DIR"], self.get_object_dir(), ".schr.link"))
+
+  def get_partial_link_file_path(self, object_file_dir : str, object_file_paths : List[str]) -> str :
+    """
+    Path of the partial link of object_file_paths, named after their directory and a digest of the objects it contains
+    """
+    group_name = get_relative_path_from(abspath(join(self._options["WORKING_DIR"], self.get_object_dir())), abspath(object_file_dir)).replace(sep, "_").replace(".", "_")
+    group_digest = blake2b("\0".join(object_file_paths).encode(), digest_size=6).hexdigest()
+    return f"{self.get_partial_link_dir()}{sep}{group_name}.{group_digest}.o"
+
+  def get_partial_link_command(self, object_file_paths : List[str], output_file_path : str) -> List[str] :
+    return [
+      self._options["CXX"],
+      *self._options["CFLAGS"].split(),
+      "-r",
+      "-nostdlib",
+      "-o",
+      output_file_path,
+      *object_file_paths
     ]
+
+  def is_target_source(self, target : SimpleCppHotReloaderTargetOptions, cpp_source_path : str) -> bool :
+    if not len(target["SOURCES"]):
+      return True
+    relative_cpp_source_path = get_relative_path_from(self._options["WORKING_DIR"], cpp_source_path)
+    return any(fnmatch(relative_cpp_source_path, source_pattern) for source_pattern in target["SOURCES"])
    
   def get_source_includes(self, cpp_source_path : str) -> List[str] :
     commands = [
@@ -108,16 +221,117 @@ class CppUtils  :
     return not self.is_user_include(cpp_include)
 
   def is_compiled(self, cpp_source_path : str) -> bool :
+    provided_module = self.get_provided_module(cpp_source_path)
+    if not provided_module is None and not exists(self.get_module_interface_file_path(cpp_source_path, provided_module)):
+      return False
     return exists(self.get_object_file_path(cpp_source_path))
+
+  def is_module_interface_file(self, cpp_source_path : str) -> bool :
+    return splitext(cpp_source_path)[1] in self.MODULE_INTERFACE_FILE_EXTS
+
+  def is_clang(self, cpp_source_path : str) -> bool :
+    return "clang" in basename(self.get_compiler(cpp_source_path))
+
+  def get_source_modules(self, cpp_source_path : str) -> SourceModules :
+    """
+    Scans the module declaration and imports of cpp_source_path, the modules provided by the project are remembered to build the module flags
+    """
+    source_modules = scan_source_modules(cpp_source_path)
+    with self._source_modules_lock:
+      previous_source_modules = self._source_modules.get(cpp_source_path, NO_SOURCE_MODULES)
+      if source_modules == NO_SOURCE_MODULES:
+        self._source_modules.pop(cpp_source_path, None)
+      else:
+        self._source_modules[cpp_source_path] = source_modules
+
+    if previous_source_modules[0] != source_modules[0]:
+      self._write_module_mapper()
+    return source_modules
+
+  def forget_source_modules(self, cpp_source_path : str) -> None :
+    with self._source_modules_lock:
+      previous_source_modules = self._source_modules.pop(cpp_source_path, NO_SOURCE_MODULES)
+    if not previous_source_modules[0] is None:
+      self._write_module_mapper()
+
+  def get_provided_module(self, cpp_source_path : str) -> Union[str, None] :
+    with self._source_modules_lock:
+      return self._source_modules.get(cpp_source_path, NO_SOURCE_MODULES)[0]
+
+  def uses_modules(self) -> bool :
+    with self._source_modules_lock:
+      return len(self._source_modules) > 0
+
+  def get_module_interface_dir(self) -> str :
+    return abspath(join(self._options["WORKING_DIR"], self.get_object_dir(), ".schr.bmi"))
+
+  def get_module_interface_file_path(self, cpp_source_path : str, module_name : str) -> str :
+    """
+    Path of the BMI of module_name, named the way clang looks for prebuilt modules
+    """
+    return f"{self.get_module_interface_dir()}{sep}{module_name.replace(':', '-')}{'.pcm' if self.is_clang(cpp_source_path) else '.gcm'}"
+
+  def get_module_mapper_file_path(self) -> str :
+    return f"{self.get_module_interface_dir()}{sep}mapper"
+
+  def get_module_flags(self, cpp_source_path : str) -> List[str] :
+    if not self.uses_modules():
+      return []
+
+    if not self.is_clang(cpp_source_path):
+      return ["-fmodules-ts", f"-fmodule-mapper={self.get_module_mapper_file_path()}"]
+
+    flags = [f"-fprebuilt-module-path={self.get_module_interface_dir()}"]
+    if not (provided_module := self.get_provided_module(cpp_source_path)) is None:
+      flags.append(f"-fmodule-output={self.get_module_interface_file_path(cpp_source_path, provided_module)}")
+    return flags
+
+  def get_module_source_arguments(self, cpp_source_path : str) -> List[str] :
+    if self.is_clang(cpp_source_path) and not self.get_provided_module(cpp_source_path) is None:
+      return ["-x", "c++-module", cpp_source_path, "-x", "none"]
+    if self.is_module_interface_file(cpp_source_path):
+      return ["-x", "c++", cpp_source_path, "-x", "none"]
+    return [cpp_source_path]
+
+  def _write_module_mapper(self) -> None :
+    """
+    GCC module mapper giving the BMI path of every module provided by the project
+    """
+    with self._source_modules_lock:
+      provided_modules = sorted((source_modules[0], cpp_source_path) for cpp_source_path, source_modules in self._source_modules.items() if not source_modules[0] is None)
+      makedirs(self.get_module_interface_dir(), exist_ok=True)
+      mapper_file_path = self.get_module_mapper_file_path()
+      with open(f"{mapper_file_path}.tmp", "w") as fd:
+        for module_name, cpp_source_path in provided_modules:
+          fd.write(f"{module_name} {self.get_module_interface_file_path(cpp_source_path, module_name)}\n")
+      replace(f"{mapper_file_path}.tmp", mapper_file_path)
   
-  def get_target_command(self) -> List[str] :
+  def get_target_command(self, target : SimpleCppHotReloaderTargetOptions) -> List[str] :
     return [
-      abspath(join(self._options["WORKING_DIR"], self._options["TARGET"])),
-      *(self._options["TARGET_ARGS"].split(" ") or []),
+      abspath(join(self._options["WORKING_DIR"], target["TARGET"])),
+      *(target["TARGET_ARGS"].split(" ") or []),
     ]
 
-  def is_target_built(self) -> bool :
-    return exists(abspath(join(self._options["WORKING_DIR"], self._options["TARGET"])))
+  def is_target_built(self, target : SimpleCppHotReloaderTargetOptions) -> bool :
+    return exists(abspath(join(self._options["WORKING_DIR"], target["TARGET"])))
+
+  def is_target_up_to_date(self, target : SimpleCppHotReloaderTargetOptions, object_file_paths : List[str]) -> bool :
+    if not self.is_target_built(target):
+      return False
+    target_mtime = getmtime(abspath(join(self._options["WORKING_DIR"], target["TARGET"])))
+    return all(exists(o) and getmtime(o) <= target_mtime for o in object_file_paths)
   
   def get_compilation_cache_file_path(self) -> str :
-    return f"{self._options['WORKING_DIR']}{sep}.schr.cache"
\ No newline at end of file
+    # The cache describes the object files it sits next to
+    if len(self._options["OBJ_DIR"]):
+      return abspath(join(self._options["WORKING_DIR"], self.get_object_dir(), ".schr.cache"))
+    return f"{self._options['WORKING_DIR']}{sep}.schr.cache"
+
+  def get_build_configurations_file_path(self) -> str :
+    return f"{self._options['WORKING_DIR']}{sep}.schr.configurations"
+
+  def get_compilation_history_file_path(self) -> str :
+    return f"{self._options['WORKING_DIR']}{sep}.schr.history"
+
+  def get_daemon_socket_path(self) -> str :
+    return f"{self._options['WORKING_DIR']}{sep}.schr.sock"
\ No newline at end of file
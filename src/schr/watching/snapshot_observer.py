@@ -0,0 +1,278 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import scandir, stat, cpu_count
+from os.path import join, abspath, basename, dirname, sep
+from threading import Thread, Event
+from time import perf_counter, time_ns
+from typing import Callable, Dict, FrozenSet, List, Set, Tuple, Union
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+
+from ..utils.logger import Logger
+
+# mtime_ns, size, inode
+FileStat = Tuple[int, int, int]
+# mtime_ns, watched file names, sub directory names
+DirectorySnapshot = Tuple[int, FrozenSet[str], FrozenSet[str]]
+
+def stat_mtime_ns(path : str) -> Union[int, None] :
+  try:
+    return stat(path).st_mtime_ns
+  except OSError:
+    return None
+
+def stat_file(path : str) -> Union[FileStat, None] :
+  try:
+    file_stat = stat(path)
+    return file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino
+  except OSError:
+    return None
+
+def stat_mtimes_ns(paths : List[str]) -> List[Union[int, None]] :
+  return [stat_mtime_ns(path) for path in paths]
+
+def stat_files(paths : List[str]) -> List[Union[FileStat, None]] :
+  return [stat_file(path) for path in paths]
+
+class SnapshotObserver:
+  """
+  Polling replacement of the watchdog observer for filesystems without inotify (e.g. NFS, some containers).
+  Keeps a compact snapshot of the watched files and of the directories of the tree, a directory is only listed again when its mtime changed,
+  and emits the created, deleted, moved (matched by inode) and modified events of the watched files to the scheduled handler.
+  When seed_paths is given (e.g. the files of the compilation graph), only their directories and the parents of these directories are polled,
+  so a directory of the tree without any of these files (e.g. a build or an asset tree) is never listed nor stated unless it is created while polling.
+  """
+
+  MIN_INTERVAL = 0.1
+  # ThreadPoolExecutor.map ignores chunksize, stats are batched by hand to keep the per task overhead low
+  STAT_BATCH_SIZE = 256
+  MAX_INTERVAL = 2.0
+  # mtimes this close to the scan time may hide a later change within the timestamp granularity (e.g. 1s on some NFS servers)
+  RACY_WINDOW_NS = 2_000_000_000
+
+  _handler : Union[FileSystemEventHandler, None] = None
+  _directories : Dict[str, DirectorySnapshot]
+  _files : Dict[str, FileStat]
+  _racy_directories : Set[str]
+  _racy_files : Set[str]
+
+  def __init__(self, is_watched_file : Callable[[str], bool], excluded_dirs : List[str], logger : Logger, seed_paths : Union[List[str], None] = None):
+    self._is_watched_file = is_watched_file
+    self._excluded_dirs = [abspath(d) for d in excluded_dirs]
+    self._seed_paths = seed_paths
+    self._logger = logger
+
+    self._directories = {}
+    self._files = {}
+    self._racy_directories = set()
+    self._racy_files = set()
+    self._executor = ThreadPoolExecutor(max_workers=min(32, (cpu_count() or 1) * 4))
+    self._stop_event = Event()
+    self._thread = Thread(target=self._run, daemon=True)
+    self.interval = self.MIN_INTERVAL
+
+  def schedule(self, handler : FileSystemEventHandler, path : str, recursive : bool = True) -> None :
+    self._handler = handler
+    self._root = abspath(path)
+
+  def start(self) -> None :
+    started_at = perf_counter()
+    if self._seed_paths is None:
+      self._scan_trees([self._root], {})
+    else:
+      self._scan_seed_directories()
+    self._logger.info(f"polling {len(self._files)} files in {len(self._directories)} directories, snapshot taken in {perf_counter() - started_at:.2f}s")
+    self._thread.start()
+
+  def stop(self) -> None :
+    self._stop_event.set()
+
+  def join(self) -> None :
+    # Waiting on the event rather than the thread keeps the main thread responsive to signals
+    while not self._stop_event.wait(1):
+      pass
+    self._thread.join()
+    self._executor.shutdown()
+
+  def _is_excluded_dir(self, path : str, name : str) -> bool :
+    return name.startswith(".") or path in self._excluded_dirs
+
+  def _scan_dir(self, path : str) -> Union[Tuple[int, Dict[str, FileStat], List[str]], None] :
+    try:
+      mtime_ns = stat(path).st_mtime_ns
+      files = {}
+      subdirs = []
+      with scandir(path) as entries:
+        for entry in entries:
+          if entry.is_dir(follow_symlinks=False):
+            if not self._is_excluded_dir(entry.path, entry.name):
+              subdirs.append(entry.name)
+          elif self._is_watched_file(entry.path) and (file_stat := stat_file(entry.path)) is not None:
+            files[entry.name] = file_stat
+      return mtime_ns, files, subdirs
+    except OSError:
+      return None
+
+  def _map_batches(self, stat_batch : Callable[[List[str]], List], paths : List[str]) -> List :
+    batches = [paths[i:i + self.STAT_BATCH_SIZE] for i in range(0, len(paths), self.STAT_BATCH_SIZE)]
+    return [result for results in self._executor.map(stat_batch, batches) for result in results]
+
+  def _mark_racy(self, path : str, mtime_ns : int, racy_paths : Set[str], scanned_at_ns : int) -> None :
+    if scanned_at_ns - mtime_ns < self.RACY_WINDOW_NS:
+      racy_paths.add(path)
+
+  def _set_directory(self, path : str, mtime_ns : int, files : Dict[str, FileStat], subdirs : List[str], scanned_at_ns : int) -> None :
+    self._directories[path] = (mtime_ns, frozenset(files), frozenset(subdirs))
+    self._mark_racy(path, mtime_ns, self._racy_directories, scanned_at_ns)
+
+  def _scan_trees(self, paths : List[str], created_files : Dict[str, FileStat]) -> None :
+    """
+    Adds the directories at paths and their sub directories to the snapshot one level at a time, listing each level in parallel
+    """
+    while len(paths):
+      scanned_at_ns = time_ns()
+      next_paths = []
+      for path, scan in zip(paths, self._executor.map(self._scan_dir, paths)):
+        if scan is None:
+          continue
+        mtime_ns, files, subdirs = scan
+        self._set_directory(path, mtime_ns, files, subdirs, scanned_at_ns)
+        for name, file_stat in files.items():
+          file_path = join(path, name)
+          self._files[file_path] = file_stat
+          created_files[file_path] = file_stat
+          self._mark_racy(file_path, file_stat[0], self._racy_files, scanned_at_ns)
+        next_paths.extend(join(path, name) for name in subdirs)
+      paths = next_paths
+
+  def _get_seed_directories(self) -> List[str] :
+    """
+    Returns the directories of the seed paths along with their parents up to the root, which must be listed to see new files and sub directories
+    """
+    directories = {self._root}
+    for seed_path in self._seed_paths:
+      parents = []
+      directory = dirname(abspath(seed_path))
+      while not directory in directories and directory.startswith(self._root + sep):
+        if self._is_excluded_dir(directory, basename(directory)):
+          parents = []
+          break
+        parents.append(directory)
+        directory = dirname(directory)
+      directories.update(parents)
+    return list(directories)
+
+  def _scan_seed_directories(self) -> None :
+    """
+    Adds the seed directories to the snapshot without walking the sub directories they do not contain,
+    these are still listed by their parent so that only their creation would be scanned
+    """
+    scanned_at_ns = time_ns()
+    paths = self._get_seed_directories()
+    for path, scan in zip(paths, self._executor.map(self._scan_dir, paths)):
+      if scan is None:
+        continue
+      mtime_ns, files, subdirs = scan
+      self._set_directory(path, mtime_ns, files, subdirs, scanned_at_ns)
+      for name, file_stat in files.items():
+        file_path = join(path, name)
+        self._files[file_path] = file_stat
+        self._mark_racy(file_path, file_stat[0], self._racy_files, scanned_at_ns)
+
+  def _remove_tree(self, path : str, deleted_files : Dict[str, FileStat]) -> None :
+    directory = self._directories.pop(path, None)
+    self._racy_directories.discard(path)
+    if directory is None:
+      return
+    for name in directory[1]:
+      file_path = join(path, name)
+      deleted_files[file_path] = self._files.pop(file_path)
+      self._racy_files.discard(file_path)
+    for name in directory[2]:
+      self._remove_tree(join(path, name), deleted_files)
+
+  def poll(self) -> List[FileSystemEvent] :
+    """
+    Updates the snapshot and returns the events that happened since the previous poll
+    """
+    scanned_at_ns = time_ns()
+    created_files : Dict[str, FileStat] = {}
+    deleted_files : Dict[str, FileStat] = {}
+    modified_files : List[str] = []
+
+    directory_paths = list(self._directories)
+    changed_directory_paths = [
+      path for path, mtime_ns in zip(directory_paths, self._map_batches(stat_mtimes_ns, directory_paths))
+      if mtime_ns != self._directories[path][0] or path in self._racy_directories
+    ]
+
+    new_directory_paths = []
+    for path, scan in zip(changed_directory_paths, self._executor.map(self._scan_dir, changed_directory_paths)):
+      if not path in self._directories:
+        # Already removed along with a parent directory
+        continue
+      if scan is None:
+        self._remove_tree(path, deleted_files)
+        continue
+
+      mtime_ns, files, subdirs = scan
+      _, previous_files, previous_subdirs = self._directories[path]
+      self._racy_directories.discard(path)
+      for name in previous_files - files.keys():
+        file_path = join(path, name)
+        deleted_files[file_path] = self._files.pop(file_path)
+        self._racy_files.discard(file_path)
+      for name in files.keys() - previous_files:
+        file_path = join(path, name)
+        self._files[file_path] = files[name]
+        created_files[file_path] = files[name]
+        self._mark_racy(file_path, files[name][0], self._racy_files, scanned_at_ns)
+      for name in previous_subdirs - set(subdirs):
+        self._remove_tree(join(path, name), deleted_files)
+      new_directory_paths.extend(join(path, name) for name in set(subdirs) - previous_subdirs)
+      self._set_directory(path, mtime_ns, files, subdirs, scanned_at_ns)
+
+    self._scan_trees(new_directory_paths, created_files)
+
+    file_paths = [path for path in self._files if not path in created_files]
+    for path, file_stat in zip(file_paths, self._map_batches(stat_files, file_paths)):
+      if file_stat is None:
+        # Its directory mtime changed as well, the next poll lists it
+        continue
+      if file_stat != self._files[path]:
+        self._files[path] = file_stat
+        modified_files.append(path)
+        self._mark_racy(path, file_stat[0], self._racy_files, scanned_at_ns)
+      elif path in self._racy_files and scanned_at_ns - file_stat[0] >= self.RACY_WINDOW_NS:
+        # A change may have kept the same mtime and size, schr compares the content anyway
+        self._racy_files.discard(path)
+        modified_files.append(path)
+
+    events : List[FileSystemEvent] = []
+    created_by_inode = {file_stat[2]: path for path, file_stat in created_files.items()}
+    for path, file_stat in deleted_files.items():
+      if file_stat[2] in created_by_inode:
+        events.append(FileMovedEvent(path, created_by_inode.pop(file_stat[2])))
+      else:
+        events.append(FileDeletedEvent(path))
+    for path in created_by_inode.values():
+      # Like inotify, a new file is created then written
+      events.append(FileCreatedEvent(path))
+      events.append(FileModifiedEvent(path))
+    events.extend(FileModifiedEvent(path) for path in modified_files)
+    return events
+
+  def _run(self) -> None :
+    while not self._stop_event.wait(self.interval):
+      started_at = perf_counter()
+      events = self.poll()
+      poll_duration = perf_counter() - started_at
+
+      for event in events:
+        try:
+          self._handler.dispatch(event)
+        except Exception as e:
+          self._logger.error(f"could not handle {event.event_type} event of {event.src_path}: {e}")
+
+      # Poll quickly while changes are coming, slow down when idle, and never spend more than half of the time polling
+      self.interval = self.MIN_INTERVAL if len(events) else min(self.interval * 1.5, self.MAX_INTERVAL)
+      self.interval = max(self.interval, poll_duration)